@@ -0,0 +1,306 @@
+"""
+Inference runtimes behind Model.
+Every runtime is reached through a core object with the subset of the
+OpenVINO IECore API the models use: read_network, load_network and infer
+requests with numpy input blobs, set_batch, async_infer, wait and outputs.
+    openvino     the OpenVINO inference engine on the .xml/.bin IR files
+    onnxruntime  ONNX Runtime on <model>.onnx next to the IR files
+    opencv       OpenCV DNN on <model>.onnx when present, else on the IR files
+    stub         the NumPy stand-ins of stub_runtime with synthetic latencies
+ONNX Runtime and OpenCV DNN infer synchronously, so their infer requests run
+on a thread pool of the core to keep async_infer non-blocking. Networks whose
+batch dimension is fixed to 1 get batched inputs one item at a time.
+The input and output layout comes from the ONNX Runtime session, or from the
+IR .xml for OpenCV DNN.
+Sample usage:
+    core = create_core("onnxruntime")
+    network = core.read_network(model="model.xml", weights="model.bin")
+    net = core.load_network(network=network, device_name="CPU", num_requests=2)
+"""
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from options import RUNTIMES
+
+
+def create_core(runtime, latency_scale=1.0):
+    """
+    Returns a new core of the runtime. latency_scale only applies to stub.
+    """
+    if runtime == "openvino":
+        from openvino.inference_engine import IECore
+
+        return IECore()
+    if runtime == "onnxruntime":
+        return OnnxRuntimeCore()
+    if runtime == "opencv":
+        return OpenCVCore()
+    if runtime == "stub":
+        from stub_runtime import StubCore
+
+        return StubCore(latency_scale)
+    raise ValueError(f"Unknown runtime {runtime}, expected one of {RUNTIMES}")
+
+
+def read_ir_layout(model_structure):
+    """
+    Returns the {name: shape} inputs and outputs of an IR .xml file. Outputs
+    are named after the layer producing them, as in OpenVINO.
+    """
+    root = ElementTree.parse(model_structure).getroot()
+    layers = {layer.get("id"): layer for layer in root.iter("layer")}
+
+    def output_shape(layer, port_id=None):
+        output = layer.find("output")
+        for port in output if output is not None else []:
+            if port_id is None or port.get("id") == port_id:
+                return [int(dim.text) for dim in port.iter("dim")]
+
+    edges = [
+        (edge.get("from-layer"), edge.get("from-port"), edge.get("to-layer"))
+        for edge in root.iter("edge")
+    ]
+    inputs = {
+        layer.get("name"): output_shape(layer)
+        for layer in layers.values()
+        if layer.get("type") in ("Parameter", "Input")
+    }
+    outputs = {}
+    results = [
+        layer_id for layer_id, layer in layers.items() if layer.get("type") == "Result"
+    ]
+    if results:
+        for from_layer, from_port, to_layer in edges:
+            if to_layer in results:
+                layer = layers[from_layer]
+                outputs[layer.get("name")] = output_shape(layer, from_port)
+    else:
+        sources = {from_layer for from_layer, _, _ in edges}
+        for layer_id, layer in layers.items():
+            if layer_id not in sources and layer.get("type") != "Const":
+                outputs[layer.get("name")] = output_shape(layer)
+    return inputs, outputs
+
+
+class LayoutInfo:
+    def __init__(self, shape):
+        self.shape = shape
+
+
+class ThreadedNetwork:
+    def __init__(self, model, inputs, outputs, fixed_batch):
+        """
+        model: Model file(s) loaded by the runtime.
+        inputs, outputs: dict, {name: shape} with the batch dimension first.
+        fixed_batch: bool, Whether the model only takes one item at a time.
+        """
+        self.model = model
+        self.inputs = {name: LayoutInfo(list(shape)) for name, shape in inputs.items()}
+        self.outputs = {
+            name: LayoutInfo(list(shape)) for name, shape in outputs.items()
+        }
+        self.layers = {}
+        self.fixed_batch = fixed_batch
+
+    @property
+    def batch_size(self):
+        return next(iter(self.inputs.values())).shape[0]
+
+    @batch_size.setter
+    def batch_size(self, batch_size):
+        for info in list(self.inputs.values()) + list(self.outputs.values()):
+            info.shape = [batch_size] + info.shape[1:]
+
+
+class InputBlob:
+    def __init__(self, shape):
+        self.buffer = np.zeros(shape, dtype=np.float32)
+
+
+class ThreadedInferRequest:
+    def __init__(self, core, network, runner):
+        self.core = core
+        self.network = network
+        self.runner = runner
+        self.input_blobs = {
+            name: InputBlob(info.shape) for name, info in network.inputs.items()
+        }
+        self.batch_size = network.batch_size
+        self.outputs = None
+        self.future = None
+
+    def set_batch(self, batch_size):
+        self.batch_size = batch_size
+
+    def run(self):
+        inputs = {
+            name: blob.buffer[: self.batch_size]
+            for name, blob in self.input_blobs.items()
+        }
+        if not self.network.fixed_batch or self.batch_size == 1:
+            self.outputs = self.runner(inputs)
+            return
+        items = [
+            self.runner({name: value[i : i + 1] for name, value in inputs.items()})
+            for i in range(self.batch_size)
+        ]
+        self.outputs = {
+            name: np.concatenate([item[name] for item in items]) for name in items[0]
+        }
+
+    def async_infer(self):
+        self.future = self.core.executor.submit(self.run)
+
+    def infer(self):
+        self.async_infer()
+        return self.wait()
+
+    def wait(self, timeout=-1):
+        """
+        Returns 0 once the inference is done, or -1 if it failed.
+        """
+        if self.future is None:
+            return 0
+        future, self.future = self.future, None
+        try:
+            future.result()
+        except Exception:
+            self.outputs = None
+            return -1
+        return 0
+
+
+class ThreadedExecutableNetwork:
+    def __init__(self, core, network, device_name, num_requests):
+        self.requests = [
+            ThreadedInferRequest(
+                core, network, core.create_runner(network, device_name)
+            )
+            for _ in range(num_requests)
+        ]
+
+    def export(self, model_file):
+        raise NotImplementedError("Compiled networks can only be exported by OpenVINO")
+
+
+class ThreadedCore:
+    """
+    Base of the cores of synchronous runtimes, subclasses implement
+    read_network and create_runner.
+    """
+
+    def __init__(self):
+        self.available_devices = ["CPU"]
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        self.lock = threading.Lock()
+
+    def add_extension(self, extension_path, device_name):
+        pass
+
+    def set_config(self, config, device_name):
+        pass
+
+    def load_network(self, network, device_name, config=None, num_requests=1):
+        return ThreadedExecutableNetwork(self, network, device_name, num_requests)
+
+    def import_network(self, model_file, device_name, config=None, num_requests=1):
+        raise NotImplementedError("Compiled networks can only be imported by OpenVINO")
+
+    def query_network(self, network, device_name):
+        return {}
+
+    def create_runner(self, network, device_name):
+        """
+        Returns a function running {name: input} through the network and
+        returning {name: output}. Every infer request gets its own runner.
+        """
+        raise NotImplementedError
+
+
+class OnnxRuntimeCore(ThreadedCore):
+    PROVIDERS = {
+        "CPU": ["CPUExecutionProvider"],
+        "GPU": ["CUDAExecutionProvider", "CPUExecutionProvider"],
+    }
+
+    def __init__(self):
+        import onnxruntime
+
+        super().__init__()
+        self.onnxruntime = onnxruntime
+        self.sessions = {}
+
+    def session(self, model, device_name):
+        # Sessions are thread safe, the infer requests of a network share one.
+        with self.lock:
+            key = (model, device_name)
+            if key not in self.sessions:
+                providers = [
+                    provider
+                    for provider in self.PROVIDERS.get(
+                        device_name, ["CPUExecutionProvider"]
+                    )
+                    if provider in self.onnxruntime.get_available_providers()
+                ]
+                self.sessions[key] = self.onnxruntime.InferenceSession(
+                    model, providers=providers
+                )
+            return self.sessions[key]
+
+    def read_network(self, model, weights=None):
+        onnx_model = os.path.splitext(model)[0] + ".onnx"
+        session = self.session(onnx_model, "CPU")
+
+        def shape(value):
+            return [dim if isinstance(dim, int) else 1 for dim in value.shape]
+
+        inputs = {value.name: shape(value) for value in session.get_inputs()}
+        outputs = {value.name: shape(value) for value in session.get_outputs()}
+        fixed_batch = all(
+            isinstance(value.shape[0], int) for value in session.get_inputs()
+        )
+        return ThreadedNetwork(onnx_model, inputs, outputs, fixed_batch)
+
+    def create_runner(self, network, device_name):
+        session = self.session(network.model, device_name)
+        output_names = list(network.outputs)
+
+        def run(inputs):
+            return dict(zip(output_names, session.run(output_names, inputs)))
+
+        return run
+
+
+class OpenCVCore(ThreadedCore):
+    TARGETS = {"GPU": "DNN_TARGET_OPENCL", "MYRIAD": "DNN_TARGET_MYRIAD"}
+
+    def read_network(self, model, weights=None):
+        # cv2.dnn does not report the input shapes, even of an ONNX model.
+        inputs, outputs = read_ir_layout(model)
+        onnx_model = os.path.splitext(model)[0] + ".onnx"
+        if os.path.exists(onnx_model):
+            model, weights = onnx_model, None
+        # OpenCV DNN takes other batch sizes than the model was exported with.
+        return ThreadedNetwork((model, weights), inputs, outputs, False)
+
+    def create_runner(self, network, device_name):
+        import cv2
+
+        model, weights = network.model
+        # A cv2.dnn.Net must not run two inferences at once, so every infer
+        # request loads its own.
+        net = cv2.dnn.readNet(model, weights) if weights else cv2.dnn.readNet(model)
+        if device_name in self.TARGETS:
+            net.setPreferableTarget(getattr(cv2.dnn, self.TARGETS[device_name]))
+        output_names = list(network.outputs)
+
+        def run(inputs):
+            for name, value in inputs.items():
+                net.setInput(np.ascontiguousarray(value), name)
+            return dict(zip(output_names, net.forward(output_names)))
+
+        return run
@@ -0,0 +1,201 @@
+"""
+Runs the headless pipeline over many recordings on a pool of processes.
+The input is either a directory of videos or a manifest file (.txt, one video
+path per line, relative paths are relative to the manifest). Every worker
+process loads the four models once and then processes recordings until none
+are left. The longest recordings are handed out first so the workers finish
+at about the same time. Each recording gets its own results directory under
+the output directory and the per-file stats are merged into report.json.
+Sample usage:
+    python batch_runner.py -fdm ... -fldm ... -hpem ... -gem ... -i recordings -o nightly -w 32
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+import pipeline
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+
+worker_args = None
+worker_load_time = None
+
+
+def build_argparser():
+    parser = pipeline.build_argparser()
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes, each with its own set of models "
+        "(number of CPUs by default)",
+    )
+    return parser
+
+
+def check_args(args):
+    """
+    Checks the pipeline arguments and that the input is a directory or a
+    manifest, logs every problem and exits if there is one.
+    """
+    path = pipeline.input_path_generator(args.input)
+    input_missing = not os.path.isdir(path) and not os.path.isfile(path)
+    if input_missing:
+        logging.error(f"Input {path} is neither a directory nor a manifest file")
+    pipeline.check_args(args, check_input=False)
+    if input_missing:
+        sys.exit(1)
+
+
+def list_inputs(input_arg):
+    path = pipeline.input_path_generator(input_arg)
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(VIDEO_EXTENSIONS)
+        )
+    base_dir = os.path.dirname(path)
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    return [
+        os.path.join(base_dir, line)
+        for line in lines
+        if line and not line.startswith("#")
+    ]
+
+
+def video_length(input_file):
+    """
+    Returns the frame count of the video from its header, 0 if it cannot be
+    opened.
+    """
+    cap = cv2.VideoCapture(input_file)
+    length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return length
+
+
+def output_names(input_files, output):
+    names = []
+    used = set()
+    for input_file in input_files:
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        unique_name = name
+        suffix = 1
+        while unique_name in used:
+            unique_name = f"{name}_{suffix}"
+            suffix += 1
+        used.add(unique_name)
+        names.append(os.path.join(output, unique_name))
+    return names
+
+
+def init_worker(args):
+    global worker_args, worker_load_time
+    worker_args = args
+    pipeline.setup_logging()
+    pipeline.configure(args)
+    pipeline.load_models(args)
+    worker_load_time = pipeline.model_loading_total_time
+
+
+def process(job):
+    input_file, output_name = job
+    try:
+        pipeline.open_input(worker_args, input_file, output_name)
+        stats = pipeline.inference()
+    except Exception as e:
+        logging.error(f"Error while processing {input_file} ~ {e}")
+        stats = {"error": str(e)}
+    except SystemExit as e:
+        # open_input exits on inputs it cannot open, a worker that exits
+        # would leave the pool waiting for its result.
+        stats = {"error": f"Could not open the input (exit status {e.code})"}
+    stats["input"] = input_file
+    stats["output"] = pipeline.output_path_generator(output_name)
+    stats["worker"] = os.getpid()
+    stats["model_loading_total_time"] = worker_load_time
+    return stats
+
+
+def merge_stats(file_stats, wall_time):
+    processed = [stats for stats in file_stats if "error" not in stats]
+    frames = sum(stats["frames"] for stats in processed)
+    stage_totals = {}
+    for stats in processed:
+        for stage, stage_total in stats["stage_totals"].items():
+            stage_totals[stage] = stage_totals.get(stage, 0) + stage_total
+    return {
+        "files": len(file_stats),
+        "failed_files": len(file_stats) - len(processed),
+        "frames": frames,
+        "wall_time": wall_time,
+        "fps": frames / wall_time if wall_time else 0,
+        "workers": len({stats["worker"] for stats in file_stats}),
+        "model_loading_total_time": sum(
+            {
+                stats["worker"]: stats["model_loading_total_time"]
+                for stats in file_stats
+            }.values()
+        ),
+        "stage_ms_per_frame": {
+            stage: 1000 * stage_total / frames if frames else 0
+            for stage, stage_total in stage_totals.items()
+        },
+        "per_file": sorted(file_stats, key=lambda stats: stats["input"]),
+    }
+
+
+def batch_runner():
+    args = build_argparser().parse_args()
+    args.headless = True
+    pipeline.setup_logging()
+    check_args(args)
+
+    input_files = list_inputs(args.input)
+    if not input_files:
+        logging.error(f"No videos found in {args.input}")
+        sys.exit(1)
+    lengths = {input_file: video_length(input_file) for input_file in input_files}
+    jobs = sorted(
+        zip(input_files, output_names(input_files, args.output)),
+        key=lambda job: lengths[job[0]],
+        reverse=True,
+    )
+    workers = max(1, min(args.workers, len(jobs)))
+    logging.info(f"Processing {len(jobs)} recordings on {workers} workers")
+
+    start_time = time.time()
+    file_stats = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=init_worker, initargs=(args,)) as pool:
+        for stats in pool.imap_unordered(process, jobs):
+            logging.info(f"Finished {stats['input']}")
+            file_stats.append(stats)
+    report = merge_stats(file_stats, time.time() - start_time)
+
+    logging.info("*********** Batch Summary ****************")
+    logging.info(f"files: {report['files']} ({report['failed_files']} failed)")
+    logging.info(f"frames: {report['frames']}")
+    logging.info(f"wall_time: {report['wall_time']} s.")
+    logging.info(f"FPS: {report['fps']}")
+    for stage, stage_ms in report["stage_ms_per_frame"].items():
+        logging.info(f"{stage}: {stage_ms:.1f} ms.")
+    logging.info("*********** Batch Summary End ***********")
+
+    report_path = os.path.join(
+        pipeline.output_path_generator(args.output), "report.json"
+    )
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    batch_runner()
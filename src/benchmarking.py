@@ -1,32 +1,353 @@
-import matplotlib.pyplot as plt
-import os 
+"""
+Benchmarks the pipeline over a matrix of precisions, devices, infer request
+counts and inputs.
+Every configuration runs in a fresh process so its model loading time and
+peak memory are its own. The models are loaded once per configuration, the
+input is processed `warmup` times without recording anything and then
+`trials` times with per-stage latency spans. All trials are written to
+results/<output>/benchmark.json together with a summary per configuration
+(medians over the trials), and comparison charts of the summary are rendered
+next to it.
+With --runtime stub the pipeline runs on the NumPy stand-ins of stub_runtime,
+which needs neither OpenVINO nor the model files, e.g. in CI. --baseline
+compares the FPS of every configuration with an earlier benchmark.json and
+exits with an error when one dropped by more than --tolerance.
+Sample usage:
+    python benchmarking.py -p FP32 FP16 INT8 -nr 1 2 4 -i demo.mp4 -o benchmark
+    python benchmarking.py -rt stub -o ci --baseline ../results/ci/baseline.json
+    python benchmarking.py --plot_only ../results/benchmark/benchmark.json
+"""
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from argparse import ArgumentParser
 
-precision_list = ['INT8', 'FP16', 'FP32']
-loading_time = []
-inference_time = []
-fps = []
+import numpy as np
+
+import pipeline
+from options import RUNTIMES
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 path_generator = lambda x: os.path.join(BASE_DIR, "results", x)
 
-for precision in precision_list:
-    with open(os.path.join(path_generator(precision), 'stats.txt'), 'r') as f:
-        loading_time.append(float(f.readline().split("\n")[0]))
-        inference_time.append(float(f.readline().split("\n")[0]))
-        fps.append(float(f.readline().split("\n")[0]))
+MODELS = {
+    "face_detection_model": "face-detection-adas-binary-0001",
+    "facial_landmarks_detection_model": "landmarks-regression-retail-0009",
+    "head_pose_estimation_model": "head-pose-estimation-adas-0001",
+    "gaze_estimation_model": "gaze-estimation-adas-0002",
+}
+CONFIG_KEYS = ["precision", "device", "num_requests", "input"]
+CHARTS = [
+    ("load_time", "Total model loading time(s)", "loading_time.png"),
+    ("fps", "FPS", "fps.png"),
+    ("frame_p95_ms", "p95 frame latency(ms)", "frame_latency.png"),
+    ("peak_rss_mb", "Peak RSS(MB)", "peak_rss.png"),
+]
+
+
+def build_argparser():
+    parser = ArgumentParser()
+    parser.add_argument(
+        "-p",
+        "--precisions",
+        nargs="+",
+        choices=list(pipeline.PRECISION_DIRS),
+        default=["FP32"],
+        help="Model precisions to benchmark (FP32 by default)",
+    )
+    parser.add_argument(
+        "-d",
+        "--devices",
+        nargs="+",
+        default=["CPU"],
+        help="Devices to benchmark (CPU by default)",
+    )
+    parser.add_argument(
+        "-nr",
+        "--num_requests",
+        nargs="+",
+        type=int,
+        default=[1, 2],
+        help="Infer request counts to benchmark (1 2 by default)",
+    )
+    parser.add_argument(
+        "-i",
+        "--inputs",
+        nargs="+",
+        default=["demo.mp4"],
+        help="Videos under bin to benchmark (demo.mp4 by default)",
+    )
+    parser.add_argument(
+        "-o", "--output", default="benchmark", help="Output directory name."
+    )
+    parser.add_argument(
+        "-w",
+        "--warmup",
+        type=int,
+        default=1,
+        help="Unrecorded runs over the input before the trials (1 by default)",
+    )
+    parser.add_argument(
+        "-t",
+        "--trials",
+        type=int,
+        default=3,
+        help="Recorded runs over the input per configuration (3 by default)",
+    )
+    parser.add_argument(
+        "-rt",
+        "--runtime",
+        choices=RUNTIMES,
+        default="openvino",
+        help="Inference runtime passed on to the pipeline (openvino by default)",
+    )
+    parser.add_argument(
+        "--pipeline_args",
+        default="",
+        help="Further pipeline arguments applied to every run, e.g. '-mf 2 -fs 1'",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="benchmark.json to compare the FPS of every configuration with",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative FPS drop against the baseline (0.2 by default)",
+    )
+    parser.add_argument(
+        "--plot_only",
+        default=None,
+        help="Only render the charts of an existing benchmark.json",
+    )
+    return parser
+
+
+def configurations(args):
+    for precision, device, num_requests, input_file in itertools.product(
+        args.precisions, args.devices, args.num_requests, args.inputs
+    ):
+        yield {
+            "precision": precision,
+            "device": device,
+            "num_requests": num_requests,
+            "input": input_file,
+        }
+
+
+def config_name(config):
+    name = os.path.splitext(os.path.basename(config["input"]))[0]
+    return f"{config['precision']}-{config['device']}-nr{config['num_requests']}-{name}"
+
+
+def pipeline_argv(args, config, output_name):
+    argv = []
+    for option, model in MODELS.items():
+        precision_dir = pipeline.PRECISION_DIRS[config["precision"]]
+        if option == "face_detection_model":
+            precision_dir = "FP32-INT1"
+        argv += [f"--{option}", f"{model}/{precision_dir}/{model}"]
+    argv += ["-i", config["input"], "-o", output_name, "-d", config["device"]]
+    argv += ["-nr", str(config["num_requests"]), "-rt", args.runtime]
+    argv += ["--headless", "--profile"]
+    return argv + args.pipeline_args.split()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def frame_latencies_ms(recorder):
+    """
+    Returns the time from the first to the last span of every frame.
+    """
+    frames = {}
+    for frame_id, _, _, start_ns, end_ns in recorder.spans:
+        if frame_id is None:
+            continue
+        first, last = frames.get(frame_id, (start_ns, end_ns))
+        frames[frame_id] = (min(first, start_ns), max(last, end_ns))
+    return np.array([last - first for first, last in frames.values()]) / 1e6
+
+
+def run_configuration(job):
+    """
+    Runs the warmup and trials of one configuration in a worker process.
+    """
+    args, config = job
+    pipeline.setup_logging()
+    output_name = os.path.join(args.output, config_name(config))
+    try:
+        pipeline_args = pipeline.build_argparser().parse_args(
+            pipeline_argv(args, config, output_name)
+        )
+        pipeline.configure(pipeline_args)
+        pipeline.load_models(pipeline_args)
+    except SystemExit:
+        # A worker that exits would leave the pool waiting for its result.
+        raise RuntimeError("Could not load the models")
+    load_time = pipeline.model_loading_total_time
+
+    trials = []
+    for trial in range(-args.warmup, args.trials):
+        trial_name = os.path.join(output_name, f"trial{max(trial, 0)}")
+        try:
+            pipeline.open_input(pipeline_args, config["input"], trial_name)
+            stats = pipeline.inference()
+        except SystemExit:
+            raise RuntimeError(f"Could not open the input {config['input']}")
+        if trial < 0:
+            continue
+        latencies = frame_latencies_ms(pipeline.recorder)
+        record = dict(config)
+        record.update(
+            {
+                "runtime": args.runtime,
+                "trial": trial,
+                "load_time": load_time,
+                "frames": stats["frames"],
+                "wall_time": stats["model_inference_total_time"],
+                "fps": stats["fps"],
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": pipeline.recorder.summary(),
+            }
+        )
+        for percentile in [50, 95, 99]:
+            record[f"frame_p{percentile}_ms"] = (
+                float(np.percentile(latencies, percentile)) if len(latencies) else 0
+            )
+        trials.append(record)
+    return trials
+
+
+def summarize(trials):
+    """
+    Returns one record per configuration with the medians over its trials.
+    """
+    groups = {}
+    for record in trials:
+        key = tuple(record[name] for name in CONFIG_KEYS)
+        groups.setdefault(key, []).append(record)
+
+    summary = []
+    for key, records in groups.items():
+        entry = dict(zip(CONFIG_KEYS, key))
+        entry["trials"] = len(records)
+        for metric, _, _ in CHARTS:
+            values = [
+                record[metric] for record in records if record[metric] is not None
+            ]
+            entry[metric] = float(np.median(values)) if values else None
+        entry["stages"] = {}
+        for stage, stats in records[0]["stages"].items():
+            stage_records = [
+                record["stages"][stage]
+                for record in records
+                if stage in record["stages"]
+            ]
+            entry["stages"][stage] = {
+                name: float(np.median([stats[name] for stats in stage_records]))
+                for name in stats
+            }
+        summary.append(entry)
+    return summary
+
+
+def render(report, output_dir):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    summary = report["summary"]
+    labels = [config_name(entry).replace("-", "\n", 3) for entry in summary]
+    for metric, ylabel, file_name in CHARTS:
+        values = [entry[metric] or 0 for entry in summary]
+        plt.figure(figsize=(max(6, 1.2 * len(labels)), 4))
+        plt.bar(labels, values)
+        plt.xlabel("Configuration")
+        plt.ylabel(ylabel)
+        plt.savefig(os.path.join(output_dir, file_name), bbox_inches="tight")
+        plt.clf()
+        plt.close()
+
+
+def compare(summary, baseline_path, tolerance):
+    """
+    Returns the configurations whose FPS dropped by more than tolerance
+    against the baseline.
+    """
+    with open(baseline_path) as f:
+        baseline = {
+            tuple(entry[name] for name in CONFIG_KEYS): entry
+            for entry in json.load(f)["summary"]
+        }
+    regressions = []
+    for entry in summary:
+        reference = baseline.get(tuple(entry[name] for name in CONFIG_KEYS))
+        if reference is None or not reference["fps"]:
+            continue
+        change = entry["fps"] / reference["fps"] - 1
+        logging.info(f"{config_name(entry)}: {100 * change:+.1f}% FPS against baseline")
+        if change < -tolerance:
+            regressions.append(config_name(entry))
+    return regressions
+
+
+def benchmarking():
+    args = build_argparser().parse_args()
+    pipeline.setup_logging()
+    if args.plot_only:
+        with open(args.plot_only) as f:
+            render(json.load(f), os.path.dirname(os.path.abspath(args.plot_only)))
+        return
+
+    output_dir = path_generator(args.output)
+    os.makedirs(output_dir, exist_ok=True)
+    trials = []
+    context = multiprocessing.get_context("spawn")
+    for config in configurations(args):
+        logging.info(f"*********** Benchmarking {config_name(config)} ***********")
+        # One process per configuration, so load time and RSS are not shared.
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            try:
+                trials += pool.apply(run_configuration, ((args, config),))
+            except Exception as e:
+                logging.error(f"Error while benchmarking {config_name(config)} ~ {e}")
+
+    report = {"args": vars(args), "trials": trials, "summary": summarize(trials)}
+    with open(os.path.join(output_dir, "benchmark.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    render(report, output_dir)
 
-plt.bar(precision_list, loading_time)
-plt.xlabel("Precision")
-plt.ylabel("Total model loading time(s)")
-plt.savefig(os.path.join(BASE_DIR, "results", "loading_time.png"), bbox_inches='tight')
+    logging.info("*********** Benchmark Summary ****************")
+    for entry in report["summary"]:
+        logging.info(
+            f"{config_name(entry)}: load {entry['load_time']:.2f} s, "
+            f"{entry['fps']:.1f} FPS, p95 {entry['frame_p95_ms']:.1f} ms"
+        )
+    logging.info("*********** Benchmark Summary End ***********")
 
-plt.bar(precision_list, inference_time)
-plt.xlabel("Precision")
-plt.ylabel("Total inference Time(s)")
-plt.savefig(os.path.join(BASE_DIR, "results", "inference_time.png"), bbox_inches='tight')
+    if args.baseline:
+        regressions = compare(report["summary"], args.baseline, args.tolerance)
+        if regressions:
+            logging.error(f"FPS regressions: {', '.join(regressions)}")
+            sys.exit(1)
 
-plt.bar(precision_list, fps)
-plt.xlabel("Precision")
-plt.ylabel("FPS")
-plt.savefig(os.path.join(BASE_DIR, "results", "fps.png"), bbox_inches='tight')
 
+if __name__ == "__main__":
+    benchmarking()
@@ -0,0 +1,458 @@
+"""
+Pipelined inference engine for the four models.
+Face detection for the next frames is started asynchronously while the
+landmark, head pose and gaze stages of the oldest frame are being processed,
+so up to num_requests frames are in flight at once. Results always come out
+in frame order.
+Within a frame the landmark and head pose stages only depend on the face
+crops, so they run concurrently and gaze estimation starts as soon as both
+are done. Each stage runs all the faces of the frame through its model in
+batches of up to the model's max_batch_size.
+With a FaceTracker the face detector only runs on the frames the tracker
+schedules, the boxes of the other frames are propagated by the tracker.
+face_limit, when set, keeps only the first (most confident) faces of a frame.
+With a FaceSmoother the faces that did not move since their last inference
+reuse its results and the head pose angles and gaze vectors are filtered over
+time. The smoother follows faces by face_id, so without a tracker the engine
+adds one that detects on every frame only to keep the ids of the faces.
+A failed inference never stops the run: a frame whose face detection failed
+comes out without faces, and the faces whose landmark, head pose or gaze
+inference failed are left out of the results of their frame.
+When the landmark and head pose models take the same input size the face
+crops are resized once and shared by both. The gaze model takes its eye
+regions straight from the frame.
+run_batch processes frames of independent sources (e.g. several cameras)
+together, so their faces share the downstream batches.
+With a StageCache the results of every stage are looked up before the stage
+runs and only the missing ones are inferred and added to the cache.
+The engine only produces results, overlays are drawn by the Renderer.
+Sample usage:
+    engine = PipelineEngine(model_dict, prob_threshold, num_requests=2)
+    for result in engine.run(frames):
+        do_something(result.frame, result.faces)
+"""
+
+import logging
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+import cv2
+from instrumentation import NULL_RECORDER
+from scheduler import StageGraph
+
+FaceResult = namedtuple(
+    "FaceResult",
+    [
+        "b_box",
+        "left_eye_coord",
+        "right_eye_coord",
+        "angle_list",
+        "gaze_vector",
+        "face_id",
+    ],
+)
+FrameResult = namedtuple("FrameResult", ["frame_id", "frame", "faces"])
+
+STAGES = [
+    "Model_FaceDetection",
+    "Model_FacialLandMarkDetection",
+    "Model_HeadPoseEstimation",
+    "Model_GazeEstimation",
+]
+
+
+class PipelineEngine:
+    def __init__(
+        self,
+        model_dict,
+        prob_threshold,
+        num_requests=2,
+        tracker=None,
+        recorder=NULL_RECORDER,
+        smoother=None,
+        cache=None,
+    ):
+        self.face_detection = model_dict["Model_FaceDetection"]
+        self.face_detection.recorder = recorder
+        self.prob_threshold = prob_threshold
+        self.num_requests = max(1, min(num_requests, self.face_detection.num_requests))
+        if smoother is not None and tracker is None:
+            # Detections are sorted by score, so without the tracker the
+            # same face_id could be a different face on the next frame.
+            from tracker import FaceTracker
+
+            tracker = FaceTracker(detection_interval=1)
+        self.tracker = tracker
+        self.recorder = recorder
+        self.smoother = smoother
+        self.cache = cache
+        self.face_limit = None
+        self.use_models(model_dict)
+        self.stage_totals = dict.fromkeys(STAGES, 0.0)
+        if self.tracker is not None:
+            self.stage_totals["FaceTracker"] = 0.0
+        if self.smoother is not None:
+            self.stage_totals["FaceSmoother"] = 0.0
+
+        self.face_graph = StageGraph()
+        self.face_graph.add_stage(
+            "Model_FacialLandMarkDetection", self.detect_landmarks
+        )
+        self.face_graph.add_stage("Model_HeadPoseEstimation", self.estimate_head_pose)
+        self.face_graph.add_stage(
+            "Model_GazeEstimation",
+            self.estimate_gaze,
+            depends_on=["Model_FacialLandMarkDetection", "Model_HeadPoseEstimation"],
+        )
+
+    def use_models(self, model_dict):
+        """
+        Switches to the landmark, head pose and gaze models of model_dict, e.g.
+        another precision of them. Takes effect with the next frame that is
+        completed; the face detector is kept since its requests are in flight.
+        """
+        self.facial_landmark_detection = model_dict["Model_FacialLandMarkDetection"]
+        self.headpose_estimation = model_dict["Model_HeadPoseEstimation"]
+        self.gaze_estimation = model_dict["Model_GazeEstimation"]
+        for model in self.models()[1:]:
+            model.recorder = self.recorder
+        self.shared_input_size = (
+            self.facial_landmark_detection.input_shape[2:]
+            == self.headpose_estimation.input_shape[2:]
+        )
+        self.resized_faces = None
+
+    def run(self, frames):
+        """
+        Consumes an iterable of frames and yields a FrameResult per frame,
+        in the order the frames were given.
+        """
+        in_flight = deque()
+        try:
+            for frame_id, frame in enumerate(frames):
+                request_id = None
+                detection = None
+                if self.cache is not None:
+                    detection = self.cache.detections(frame_id)
+                if detection is not None:
+                    if self.tracker is not None:
+                        # The tracked faces are stale after cached frames.
+                        self.tracker.lost = True
+                elif self.tracker is None or self.tracker.schedule():
+                    start_time = time.time()
+                    self.face_detection.frame_id = frame_id
+                    request_id = self.face_detection.submit(frame)
+                    self.stage_totals["Model_FaceDetection"] += time.time() - start_time
+                in_flight.append((frame_id, frame, request_id, detection))
+                if len(in_flight) >= self.num_requests:
+                    yield self.complete(*in_flight.popleft())
+            while in_flight:
+                yield self.complete(*in_flight.popleft())
+        finally:
+            # Drain requests left behind when the consumer stops early so the
+            # infer request slots are idle before the next run.
+            for _, _, request_id, _ in in_flight:
+                if request_id is not None:
+                    self.face_detection.wait(request_id)
+
+    def complete(self, frame_id, frame, request_id, detection=None):
+        if detection is not None:
+            b_boxes, face_ids = detection
+        elif request_id is None:
+            start_time = time.time()
+            with self.recorder.span(frame_id, "infer", "FaceTracker"):
+                b_boxes, face_ids = self.tracker.track(frame)
+            self.stage_totals["FaceTracker"] += time.time() - start_time
+        else:
+            start_time = time.time()
+            self.face_detection.frame_id = frame_id
+            b_boxes = self.face_detection.collect(
+                request_id, frame, self.prob_threshold
+            )
+            self.stage_totals["Model_FaceDetection"] += time.time() - start_time
+            if b_boxes is None:
+                logging.warning(f"Face detection failed on frame {frame_id}")
+                if self.tracker is not None:
+                    # Keeps the tracked faces and detects again next frame.
+                    self.tracker.lost = True
+                return FrameResult(frame_id, frame, [])
+            if self.tracker is not None:
+                face_ids = self.tracker.update(frame, b_boxes)
+            else:
+                face_ids = list(range(len(b_boxes)))
+        if detection is None and self.cache is not None:
+            self.cache.put_detections(frame_id, b_boxes, face_ids)
+        if self.face_limit is not None:
+            b_boxes, face_ids = b_boxes[: self.face_limit], face_ids[: self.face_limit]
+
+        faces = []
+        if len(b_boxes):
+            cropped_faces = [
+                frame[b_box[1] : b_box[3], b_box[0] : b_box[2]] for b_box in b_boxes
+            ]
+            if self.smoother is None:
+                faces = self.process_faces(
+                    frame_id, [frame] * len(b_boxes), cropped_faces, b_boxes, face_ids
+                )
+            else:
+                faces = self.smooth_faces(
+                    frame_id, frame, cropped_faces, b_boxes, face_ids
+                )
+        return FrameResult(frame_id, frame, faces)
+
+    def run_batch(self, frames):
+        """
+        Processes frames of independent sources together and returns a list of
+        FaceResult lists, one per frame. Face detection runs on up to
+        num_requests frames at once and the faces of all the frames go through
+        the downstream models as one batch.
+        """
+        detections = []
+        for start in range(0, len(frames), self.num_requests):
+            chunk = frames[start : start + self.num_requests]
+            start_time = time.time()
+            request_ids = [self.face_detection.submit(frame) for frame in chunk]
+            for frame, request_id in zip(chunk, request_ids):
+                frame_boxes = self.face_detection.collect(
+                    request_id, frame, self.prob_threshold
+                )
+                if frame_boxes is None:
+                    logging.warning("Face detection failed on a frame of the batch")
+                    frame_boxes = []
+                detections.append(frame_boxes)
+            self.stage_totals["Model_FaceDetection"] += time.time() - start_time
+
+        face_frames, cropped_faces, b_boxes, face_ids, owners = [], [], [], [], []
+        for index, (frame, frame_boxes) in enumerate(zip(frames, detections)):
+            for face_id, b_box in enumerate(frame_boxes):
+                face_frames.append(frame)
+                cropped_faces.append(frame[b_box[1] : b_box[3], b_box[0] : b_box[2]])
+                b_boxes.append(b_box)
+                face_ids.append(face_id)
+                owners.append(index)
+
+        results = [[] for _ in frames]
+        if b_boxes:
+            faces = self.process_faces(
+                None, face_frames, cropped_faces, b_boxes, face_ids
+            )
+            for owner, face in zip(owners, faces):
+                results[owner].append(face)
+        return results
+
+    def smooth_faces(self, frame_id, frame, cropped_faces, b_boxes, face_ids):
+        """
+        Runs only the faces that moved since their last inference through the
+        downstream models, reuses the last results of the other faces and
+        filters the angles and gaze vectors of all of them.
+        """
+        start_time = time.time()
+        with self.recorder.span(frame_id, "preprocess", "FaceSmoother"):
+            moved = [
+                i
+                for i, (face_id, cropped_face) in enumerate(
+                    zip(face_ids, cropped_faces)
+                )
+                if self.smoother.moved(frame_id, face_id, cropped_face)
+            ]
+        self.stage_totals["FaceSmoother"] += time.time() - start_time
+
+        inferred = {}
+        if moved:
+            inferred = dict(
+                zip(
+                    moved,
+                    self.process_faces(
+                        frame_id,
+                        [frame] * len(moved),
+                        [cropped_faces[i] for i in moved],
+                        [b_boxes[i] for i in moved],
+                        [face_ids[i] for i in moved],
+                    ),
+                )
+            )
+
+        start_time = time.time()
+        faces = []
+        with self.recorder.span(frame_id, "postprocess", "FaceSmoother"):
+            for i, (b_box, face_id) in enumerate(zip(b_boxes, face_ids)):
+                if i in inferred:
+                    face = self.smoother.update(frame_id, inferred[i], True)
+                elif i in moved:
+                    # Its inference failed and its last results are outdated.
+                    continue
+                else:
+                    face = self.smoother.last(face_id)._replace(b_box=b_box)
+                    face = self.smoother.update(frame_id, face, False)
+                faces.append(face)
+            self.smoother.evict(frame_id)
+        self.stage_totals["FaceSmoother"] += time.time() - start_time
+        return faces
+
+    def process_faces(self, frame_id, frames, cropped_faces, b_boxes, face_ids):
+        """
+        Runs the faces through the landmark, head pose and gaze models. frames
+        holds the frame of every face, the eye regions are taken from it.
+        """
+        for model in self.models()[1:]:
+            model.frame_id = frame_id
+        context, durations = self.face_graph.run(
+            frame_id=frame_id,
+            frames=frames,
+            b_boxes=b_boxes,
+            model_faces=self.resize_faces(cropped_faces),
+        )
+        for stage, duration in durations.items():
+            self.stage_totals[stage] += duration
+        # The gaze stage is skipped when one of the stages before it failed.
+        failed = [stage for stage in STAGES[1:3] if context[stage] is None]
+        if not failed and context["Model_GazeEstimation"] is None:
+            failed = ["Model_GazeEstimation"]
+        if failed:
+            frame = "the batch" if frame_id is None else f"frame {frame_id}"
+            logging.warning(
+                f"{' and '.join(failed)} failed, dropping {len(b_boxes)} faces "
+                f"of {frame}"
+            )
+            return []
+
+        faces = []
+        for (
+            b_box,
+            face_id,
+            (left_eye_coord, right_eye_coord),
+            angle_list,
+            gaze_vector,
+        ) in zip(
+            b_boxes,
+            face_ids,
+            context["Model_FacialLandMarkDetection"],
+            context["Model_HeadPoseEstimation"],
+            context["Model_GazeEstimation"],
+        ):
+            faces.append(
+                FaceResult(
+                    b_box,
+                    left_eye_coord,
+                    right_eye_coord,
+                    angle_list,
+                    gaze_vector,
+                    face_id,
+                )
+            )
+        return faces
+
+    def resize_faces(self, cropped_faces):
+        """
+        Returns the face crops to feed the landmark and head pose models,
+        resized once into a reused buffer when both models share an input size.
+        """
+        if not self.shared_input_size:
+            return cropped_faces
+        height, width = self.facial_landmark_detection.input_shape[2:]
+        if self.resized_faces is None or len(self.resized_faces) < len(cropped_faces):
+            self.resized_faces = np.empty(
+                (len(cropped_faces), height, width, 3), dtype=np.uint8
+            )
+        for cropped_face, resized_face in zip(cropped_faces, self.resized_faces):
+            cv2.resize(
+                cropped_face,
+                (width, height),
+                dst=resized_face,
+                interpolation=cv2.INTER_AREA,
+            )
+        return list(self.resized_faces[: len(cropped_faces)])
+
+    def cached_stage(self, stage, context, infer, to_values, from_values):
+        """
+        Returns the results of a stage for all the faces of the context. Faces
+        found in the stage cache are not inferred again, infer(indexes)
+        returns the results of the other faces, which are then cached.
+        """
+        b_boxes = context["b_boxes"]
+        if self.cache is None:
+            # None when the inference failed.
+            return infer(list(range(len(b_boxes))))
+        results = []
+        for b_box in b_boxes:
+            values = self.cache.get(stage, context["frame_id"], b_box)
+            results.append(None if values is None else from_values(values))
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            inferred = infer(missing)
+            if inferred is None:
+                return None
+            for i, result in zip(missing, inferred):
+                results[i] = result
+                self.cache.put(
+                    stage, context["frame_id"], b_boxes[i], to_values(result)
+                )
+        return results
+
+    def detect_landmarks(self, context):
+        def infer(indexes):
+            return self.facial_landmark_detection.predict_batch(
+                [context["model_faces"][i] for i in indexes],
+                self.prob_threshold,
+                [context["b_boxes"][i] for i in indexes],
+            )
+
+        return self.cached_stage(
+            "landmarks",
+            context,
+            infer,
+            lambda eye_coords: dict(
+                zip(["left_eye_coord", "right_eye_coord"], eye_coords)
+            ),
+            lambda values: (values["left_eye_coord"], values["right_eye_coord"]),
+        )
+
+    def estimate_head_pose(self, context):
+        def infer(indexes):
+            return self.headpose_estimation.predict_batch(
+                [context["model_faces"][i] for i in indexes], self.prob_threshold
+            )
+
+        return self.cached_stage(
+            "head_pose",
+            context,
+            infer,
+            lambda angle_list: {"angle_list": angle_list},
+            lambda values: values["angle_list"],
+        )
+
+    def estimate_gaze(self, context):
+        eye_coords = context["Model_FacialLandMarkDetection"]
+        angle_lists = context["Model_HeadPoseEstimation"]
+        if eye_coords is None or angle_lists is None:
+            return None
+
+        def infer(indexes):
+            return self.gaze_estimation.predict_batch(
+                [context["frames"][i] for i in indexes],
+                [context["b_boxes"][i] for i in indexes],
+                [eye_coords[i][0] for i in indexes],
+                [eye_coords[i][1] for i in indexes],
+                [angle_lists[i] for i in indexes],
+            )
+
+        return self.cached_stage(
+            "gaze",
+            context,
+            infer,
+            lambda gaze_vector: {"gaze_vector": gaze_vector},
+            lambda values: values["gaze_vector"],
+        )
+
+    def models(self):
+        return [
+            self.face_detection,
+            self.facial_landmark_detection,
+            self.headpose_estimation,
+            self.gaze_estimation,
+        ]
+
+    def close(self):
+        self.face_graph.close()
@@ -1,34 +1,36 @@
-import cv2
 from model import Model
 
 
 class Model_FacialLandMarkDetection(Model):
-    def predict(self, cropped_face, flags, prob_threshold, b_box, output_frame):
-        processed_input = self.preprocess_input(cropped_face)
-        async_infer = self.net.start_async(request_id=0, inputs=processed_input)
-        if async_infer.wait() == 0:
-            result = async_infer.outputs[self.output_name]
-            left_eye_coord, right_eye_coord, image = self.preprocess_outputs(
-                output_frame, flags, result, b_box
-            )
-            return left_eye_coord, right_eye_coord, image
+    def predict(self, cropped_face, prob_threshold, b_box):
+        outputs = self.infer_images([cropped_face])
+        if outputs is not None:
+            result = outputs[self.output_name]
+            left_eye_coord, right_eye_coord = self.preprocess_outputs(result, b_box)
+            return left_eye_coord, right_eye_coord
 
-    def preprocess_outputs(self, image, flags, outputs, cropped_face):
-        height = cropped_face[3] - cropped_face[1]
-        width = cropped_face[2] - cropped_face[0]
+    def predict_batch(self, cropped_faces, prob_threshold, b_boxes):
+        eye_coords = []
+        for faces, boxes in zip(self.chunks(cropped_faces), self.chunks(b_boxes)):
+            outputs = self.infer_images(faces)
+            if outputs is None:
+                return None
+            with self.recorder.span(self.frame_id, "postprocess", self.name):
+                result = outputs[self.output_name]
+                for i, b_box in enumerate(boxes):
+                    eye_coords.append(self.preprocess_outputs(result[i], b_box))
+        return eye_coords
+
+    def preprocess_outputs(self, outputs, b_box):
+        """
+        Returns the eye coordinates in pixels of the face crop, scaled from
+        the relative landmarks by the size of the [xmin, ymin, xmax, ymax]
+        b_box the crop was taken from.
+        """
+        height = b_box[3] - b_box[1]
+        width = b_box[2] - b_box[0]
         landmarks = outputs.reshape(1, 10)[0]
 
-        for i in range(2):
-            x_coord = int(landmarks[i * 2] * width)
-            y_coord = int(landmarks[i * 2 + 1] * height)
-            if flags and "fldm" in flags:
-                image = cv2.circle(
-                    image,
-                    (cropped_face[0] + x_coord, cropped_face[1] + y_coord),
-                    30,
-                    (0, 0, 255),
-                    2,
-                )
         left_eye_coord = [landmarks[0] * width, landmarks[1] * height]
         right_eye_coord = [landmarks[2] * width, landmarks[3] * height]
-        return left_eye_coord, right_eye_coord, image
+        return left_eye_coord, right_eye_coord
@@ -0,0 +1,116 @@
+"""
+Raw frame store for deterministic, decode-free input.
+A recording is a single file that holds a fixed header, the frames as raw BGR
+pixels one after the other, and an index of their timestamps at the end:
+    header  magic, version, width, height, frame count, fps and the offset
+            of the index, padded to HEADER_SIZE bytes so the frames start
+            page aligned
+    frames  count x height x width x 3 uint8
+    index   count int64 nanoseconds since the first frame
+FrameStoreWriter appends the frames while a video or camera is decoded,
+optionally resized to a fixed size such as the face detector input, and
+completes the header on close. An interrupted recording keeps a frame count
+of 0 and is rejected. FrameStore memory-maps a recording copy-on-write, so
+every frame is a view of the page cache that is only copied when something
+draws on it.
+Sample usage:
+    writer = FrameStoreWriter("session.frames", fps=30, size=(672, 384))
+    writer.write(frame, timestamp_ns)
+    writer.close()
+    store = FrameStore("session.frames")
+    frame = store.frame(0)
+"""
+import struct
+
+import numpy as np
+
+import cv2
+
+FRAME_STORE_EXTENSION = ".frames"
+MAGIC = b"CPCFRAME"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIQdQ")
+HEADER_SIZE = 4096
+
+
+def is_frame_store(path):
+    return path.lower().endswith(FRAME_STORE_EXTENSION)
+
+
+class FrameStoreWriter:
+    def __init__(self, path, fps=0, size=None):
+        """
+        path: str, File of the recording, overwritten if it exists.
+        fps: float, Frame rate of the source, estimated from the timestamps
+             on close when 0.
+        size: tuple, (width, height) the frames are resized to, the size of
+              the first frame by default.
+        """
+        self.path = path
+        self.fps = fps
+        self.size = tuple(size) if size else None
+        self.timestamps = []
+        self.file = open(path, "wb")
+        self.file.write(bytes(HEADER_SIZE))
+
+    def write(self, frame, timestamp_ns):
+        if self.size is None:
+            self.size = (frame.shape[1], frame.shape[0])
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self.file.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        self.timestamps.append(timestamp_ns)
+
+    def close(self):
+        """
+        Writes the index and the header, returns the number of frames.
+        """
+        timestamps = np.array(self.timestamps, dtype="<i8")
+        if len(timestamps):
+            timestamps -= timestamps[0]
+        fps = self.fps
+        if not fps and len(timestamps) > 1 and timestamps[-1] > 0:
+            fps = (len(timestamps) - 1) * 1e9 / timestamps[-1]
+        index_offset = self.file.tell()
+        self.file.write(timestamps.tobytes())
+        width, height = self.size or (0, 0)
+        self.file.seek(0)
+        self.file.write(
+            HEADER.pack(
+                MAGIC, VERSION, width, height, len(timestamps), fps, index_offset
+            )
+        )
+        self.file.close()
+        return len(timestamps)
+
+
+class FrameStore:
+    def __init__(self, path):
+        """
+        path: str, File of a recording made by FrameStoreWriter.
+        """
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path} is not a frame store")
+        magic, version, width, height, count, fps, index_offset = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a frame store of version {VERSION}")
+        if not count:
+            raise ValueError(f"{path} is an empty or interrupted recording")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frames = np.memmap(
+            path, np.uint8, "c", HEADER_SIZE, (count, height, width, 3)
+        )
+        self.timestamps = np.memmap(path, "<i8", "r", index_offset, (count,))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame(self, index):
+        """
+        Returns the frame as a copy-on-write view of the recording.
+        """
+        return np.asarray(self.frames[index])
@@ -0,0 +1,375 @@
+"""
+Publishes the results of every processed frame to other local processes.
+Every face becomes one fixed-size EVENT_DTYPE record of 88 little-endian
+bytes: sequence number, publish time (CLOCK_MONOTONIC, comparable between the
+processes of the machine), frame id, face id, number of faces of the frame,
+box, eye coordinates, yaw/pitch/roll and gaze vector. A frame without faces
+is published as one record with face_id -1 and faces 0, so subscribers see
+every processed frame. The sequence numbers count the records from 0 on. The
+records go to either or both transports:
+    shared memory  a ring of capacity records after a RING_HEADER in the
+                   segment /dev/shm/<name>. The oldest records are
+                   overwritten, subscribers poll the published count and
+                   skip the records overwritten before they read them.
+                   The header is flagged closed when the publisher stops.
+    Unix socket    a SOCK_SEQPACKET socket on which every frame is one
+                   message holding its records. Subscribers connect and
+                   disconnect at will, a subscriber that does not keep up
+                   misses frames once its socket buffer is full.
+Publishing never waits for a subscriber: the ring is written in place and the
+socket is non-blocking. Run this module to print the events as CSV.
+Sample usage:
+    publisher = GazePublisher(shm_name="gaze", socket_path="/tmp/gaze.sock")
+    publisher.publish(result)
+    publisher.close()
+
+    subscriber = RingSubscriber("gaze")
+    for record in subscriber.poll():
+        print(record["frame_id"], record["gaze_vector"])
+
+    python gaze_publisher.py --socket /tmp/gaze.sock
+"""
+import logging
+import os
+import socket
+import time
+from argparse import ArgumentParser
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+EVENT_DTYPE = np.dtype(
+    [
+        ("seq", "<i8"),
+        ("timestamp_ns", "<i8"),
+        ("frame_id", "<i8"),
+        ("face_id", "<i4"),
+        ("faces", "<i4"),
+        ("b_box", "<i4", (4,)),
+        ("left_eye_coord", "<f4", (2,)),
+        ("right_eye_coord", "<f4", (2,)),
+        ("angle_list", "<f4", (3,)),
+        ("gaze_vector", "<f4", (3,)),
+    ]
+)
+RING_HEADER = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("record_size", "<u4"),
+        ("capacity", "<u8"),
+        ("count", "<u8"),
+        ("closed", "<u4"),
+    ]
+)
+RING_OFFSET = 64
+MAGIC = b"CPCGAZE"
+VERSION = 1
+# Receive buffer of a socket subscriber, enough for 744 faces per frame.
+MAX_MESSAGE = 1 << 16
+
+
+def frame_records(result, timestamp_ns):
+    """
+    Returns the EVENT_DTYPE records of a FrameResult.
+    """
+    faces = result.faces
+    records = np.zeros(max(1, len(faces)), dtype=EVENT_DTYPE)
+    records["seq"] = -1
+    records["timestamp_ns"] = timestamp_ns
+    records["frame_id"] = result.frame_id
+    records["faces"] = len(faces)
+    if not faces:
+        records["face_id"] = -1
+        records["b_box"] = -1
+        return records
+    records["face_id"] = [face.face_id for face in faces]
+    records["b_box"] = [face.b_box for face in faces]
+    records["left_eye_coord"] = [face.left_eye_coord for face in faces]
+    records["right_eye_coord"] = [face.right_eye_coord for face in faces]
+    records["angle_list"] = [face.angle_list for face in faces]
+    records["gaze_vector"] = [face.gaze_vector for face in faces]
+    return records
+
+
+def create_segment(name, size):
+    try:
+        return shared_memory.SharedMemory(name, create=True, size=size)
+    except FileExistsError:
+        # Left behind by a publisher that did not shut down.
+        stale = shared_memory.SharedMemory(name)
+        stale.close()
+        stale.unlink()
+        return shared_memory.SharedMemory(name, create=True, size=size)
+
+
+def attach_segment(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Before Python 3.13 an attached segment is registered with the
+        # resource tracker, which unlinks it when the subscriber exits.
+        segment = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class GazePublisher:
+    def __init__(self, shm_name=None, socket_path=None, capacity=1024):
+        """
+        shm_name: str, Name of the shared memory ring, None for no ring.
+        socket_path: str, Path of the Unix socket, None for no socket.
+        capacity: int, Records kept in the ring.
+        """
+        self.socket_path = socket_path
+        self.segment = None
+        self.header = None
+        self.ring = None
+        self.listener = None
+        self.subscribers = []
+        self.published = 0
+        self.dropped = 0
+        if shm_name:
+            capacity = max(1, capacity)
+            self.segment = create_segment(
+                shm_name, RING_OFFSET + capacity * EVENT_DTYPE.itemsize
+            )
+            self.header = np.ndarray((), RING_HEADER, self.segment.buf)
+            self.header["magic"] = MAGIC
+            self.header["version"] = VERSION
+            self.header["record_size"] = EVENT_DTYPE.itemsize
+            self.header["capacity"] = capacity
+            self.header["count"] = 0
+            self.header["closed"] = 0
+            self.ring = np.ndarray(
+                (capacity,), EVENT_DTYPE, self.segment.buf, RING_OFFSET
+            )
+            self.ring["seq"] = -1
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            self.listener.bind(socket_path)
+            self.listener.listen()
+            self.listener.setblocking(False)
+
+    def publish(self, result):
+        records = frame_records(result, time.monotonic_ns())
+        if self.ring is not None:
+            self.write_ring(records)
+        records["seq"] = np.arange(self.published, self.published + len(records))
+        if self.listener is not None:
+            self.send(records)
+        self.published += len(records)
+
+    def write_ring(self, records):
+        """
+        Appends the records, whose seq is -1, to the ring.
+        """
+        count = int(self.header["count"])
+        capacity = len(self.ring)
+        for record in records:
+            slot = count % capacity
+            # The sequence number is written last and invalidated first, so
+            # a subscriber can tell a record that changed while it read it.
+            self.ring["seq"][slot] = -1
+            self.ring[slot] = record
+            self.ring["seq"][slot] = count
+            count += 1
+        self.header["count"] = count
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            connection.setblocking(False)
+            self.subscribers.append(connection)
+            logging.info(f"Gaze subscriber {len(self.subscribers)} connected")
+
+    def send(self, records):
+        self.accept()
+        message = records.tobytes()
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.send(message)
+            except BlockingIOError:
+                self.dropped += 1
+            except OSError:
+                self.subscribers.remove(subscriber)
+                subscriber.close()
+
+    def close(self):
+        for subscriber in self.subscribers:
+            subscriber.close()
+        self.subscribers = []
+        if self.listener is not None:
+            self.listener.close()
+            os.remove(self.socket_path)
+            self.listener = None
+        if self.segment is not None:
+            self.header["closed"] = 1
+            # The arrays must let go of the buffer before it can be closed.
+            self.header = None
+            self.ring = None
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+
+
+class RingSubscriber:
+    """
+    Reads the records of a GazePublisher shared memory ring.
+    """
+
+    def __init__(self, shm_name, from_start=False):
+        self.segment = attach_segment(shm_name)
+        self.header = np.ndarray((), RING_HEADER, self.segment.buf)
+        if (
+            self.header["magic"] != MAGIC
+            or self.header["version"] != VERSION
+            or self.header["record_size"] != EVENT_DTYPE.itemsize
+        ):
+            self.close()
+            raise ValueError(f"{shm_name} is not a gaze ring of version {VERSION}")
+        self.ring = np.ndarray(
+            (int(self.header["capacity"]),), EVENT_DTYPE, self.segment.buf, RING_OFFSET
+        )
+        self.next = 0 if from_start else int(self.header["count"])
+        self.missed = 0
+
+    def poll(self):
+        """
+        Returns the records published since the last poll, oldest first.
+        Records overwritten before they were read are counted in missed.
+        """
+        count = int(self.header["count"])
+        capacity = len(self.ring)
+        if count - self.next > capacity:
+            self.missed += count - capacity - self.next
+            self.next = count - capacity
+        records = []
+        for seq in range(self.next, count):
+            slot = seq % capacity
+            before = self.ring["seq"][slot]
+            record = self.ring[slot].copy()
+            if before != seq or self.ring["seq"][slot] != seq:
+                self.missed += 1
+                continue
+            record["seq"] = seq
+            records.append(record)
+        self.next = count
+        return np.array(records, dtype=EVENT_DTYPE)
+
+    @property
+    def closed(self):
+        return bool(self.header["closed"])
+
+    def close(self):
+        self.header = None
+        self.ring = None
+        self.segment.close()
+
+
+class SocketSubscriber:
+    """
+    Receives the records of a GazePublisher socket, one frame at a time.
+    """
+
+    def __init__(self, socket_path):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.connection.connect(socket_path)
+
+    def receive(self):
+        """
+        Returns the records of the next frame, or None once the publisher closed.
+        """
+        message = self.connection.recv(MAX_MESSAGE)
+        if not message:
+            return None
+        return np.frombuffer(message, dtype=EVENT_DTYPE)
+
+    def close(self):
+        self.connection.close()
+
+
+def build_argparser():
+    parser = ArgumentParser(description="Prints the events of a GazePublisher")
+    parser.add_argument(
+        "--shm", type=str, default=None, help="Name of the shared memory ring"
+    )
+    parser.add_argument(
+        "--socket", type=str, default=None, help="Path of the Unix socket"
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=0.005,
+        help="Seconds between two polls of the shared memory ring (0.005 by "
+        "default)",
+    )
+    return parser
+
+
+def columns():
+    names = []
+    for name in EVENT_DTYPE.names:
+        shape = EVENT_DTYPE[name].shape
+        names += [name] if not shape else [f"{name}_{i}" for i in range(shape[0])]
+    return names
+
+
+def row(record):
+    values = []
+    for name in EVENT_DTYPE.names:
+        values += np.atleast_1d(record[name]).tolist()
+    return ",".join(
+        f"{value:.6g}" if isinstance(value, float) else str(value) for value in values
+    )
+
+
+def events(args):
+    """
+    Yields the records of the ring or socket given on the command line.
+    """
+    if args.socket:
+        subscriber = SocketSubscriber(args.socket)
+        try:
+            while True:
+                records = subscriber.receive()
+                if records is None:
+                    return
+                yield from records
+        finally:
+            subscriber.close()
+    subscriber = RingSubscriber(args.shm)
+    try:
+        while True:
+            # Records published before the publisher closed are still read.
+            closed = subscriber.closed
+            yield from subscriber.poll()
+            if closed:
+                return
+            time.sleep(args.poll_interval)
+    finally:
+        if subscriber.missed:
+            logging.warning(f"Missed {subscriber.missed} records")
+        subscriber.close()
+
+
+def main():
+    parser = build_argparser()
+    args = parser.parse_args()
+    if not args.shm and not args.socket:
+        parser.error("one of --shm or --socket is required")
+    print(",".join(columns()), flush=True)
+    try:
+        for record in events(args):
+            print(row(record), flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
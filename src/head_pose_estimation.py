@@ -1,30 +1,31 @@
-import cv2
 from model import Model
 
 
 class Model_HeadPoseEstimation(Model):
-    def predict(self, cropped_face, flags, prob_threshold, output_frame):
-        processed_input = self.preprocess_input(cropped_face)
-        async_infer = self.net.start_async(request_id=0, inputs=processed_input)
-        if async_infer.wait() == 0:
-            result = async_infer.outputs
-            angle_list, image = self.preprocess_outputs(output_frame, flags, result)
-            return angle_list, image
+    def predict(self, cropped_face, prob_threshold):
+        outputs = self.infer_images([cropped_face])
+        if outputs is not None:
+            result = outputs
+            angle_list = self.preprocess_outputs(result)
+            return angle_list
 
-    def preprocess_outputs(self, image, flags, outputs):
+    def predict_batch(self, cropped_faces, prob_threshold):
+        angle_lists = []
+        for faces in self.chunks(cropped_faces):
+            outputs = self.infer_images(faces)
+            if outputs is None:
+                return None
+            with self.recorder.span(self.frame_id, "postprocess", self.name):
+                for i in range(len(faces)):
+                    result = {
+                        name: output[i : i + 1] for name, output in outputs.items()
+                    }
+                    angle_lists.append(self.preprocess_outputs(result))
+        return angle_lists
+
+    def preprocess_outputs(self, outputs):
         yaw = outputs["angle_y_fc"][0][0]
         pitch = outputs["angle_p_fc"][0][0]
         roll = outputs["angle_r_fc"][0][0]
 
-        if flags and "hpem" in flags:
-            image = cv2.putText(
-                image, f"yaw:{yaw:.1f}", (20, 20), 0, 0.6, (255, 255, 0)
-            )
-            image = cv2.putText(
-                image, f"pitch:{pitch:.1f}", (20, 40), 0, 0.6, (255, 255, 0)
-            )
-            image = cv2.putText(
-                image, f"roll:{roll:.1f}", (20, 60), 0, 0.6, (255, 255, 0)
-            )
-
-        return [yaw, pitch, roll], image
+        return [yaw, pitch, roll]
@@ -6,54 +6,355 @@ Sample usage:
     for batch in feed.next_batch():
         do_something(batch)
     feed.close()
+Frames of videos and webcams are decoded ahead of time by a background thread
+into a bounded buffer, so decoding overlaps whatever the caller does with the
+previous frames. Which decoded frames are handed out depends on skip_policy:
+    'nth'    every skip-th frame, e.g. skip=10 yields frames 9, 19, 29, ...
+    'all'    every frame
+    'latest' only the most recent frame, older buffered frames are dropped.
+             Meant for live webcam feeds where stale frames are useless.
+For input_type 'image' the input file is a single image, a directory of
+images or a glob pattern. The images are decoded in parallel on a pool of
+worker threads, at most buffer_size per worker ahead of the caller, and
+come out in sorted path order. They may differ in size and have no frame
+rate, fps() is 0 and frame_initials_and_length() gives the size of the first
+image.
+For input_type 'replay' the input file is a frame store recorded with
+FrameStoreWriter. Its frames are read from the memory-mapped file without
+decoding or a reader thread. With replay_speed 0 they come out as fast as the
+caller asks for them; otherwise no sooner than their recorded timestamps
+divided by replay_speed, and the 'latest' policy then drops the frames whose
+time has passed, like a live camera. A video or webcam can be recorded into
+a frame store while it is decoded by passing a FrameStoreWriter as record, it
+receives every decoded frame, including the skipped ones.
 """
-from numpy import ndarray
+import glob
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 import cv2
+from frame_store import FrameStore
+from instrumentation import NULL_RECORDER
+from options import SKIP_POLICIES
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def is_image_input(input_file):
+    """
+    Returns whether the input is an image, a directory or a glob pattern.
+    """
+    return (
+        os.path.isdir(input_file)
+        or glob.has_magic(input_file)
+        or input_file.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def image_paths(input_file):
+    """
+    Returns the sorted image files of a single image, a directory or a glob
+    pattern.
+    """
+    if os.path.isdir(input_file):
+        paths = [os.path.join(input_file, name) for name in os.listdir(input_file)]
+    elif glob.has_magic(input_file):
+        paths = glob.glob(input_file)
+    else:
+        return [input_file]
+    return sorted(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def read_image(path):
+    start_ns = time.perf_counter_ns()
+    image = cv2.imread(path)
+    return image, start_ns, time.perf_counter_ns()
 
 
 class InputFeeder:
-    def __init__(self, input_type, input_file=None):
+    def __init__(
+        self,
+        input_type,
+        input_file=None,
+        skip_policy="nth",
+        skip=10,
+        buffer_size=8,
+        recorder=NULL_RECORDER,
+        workers=None,
+        record=None,
+        replay_speed=0,
+    ):
         """
         input_type: str, The type of input. Can be 'video' for video file, 'image' for image file,
-                    or 'cam' to use webcam feed.
-        input_file: str, The file that contains the input image or video file. Leave empty for cam input_type.
+                    'replay' for a frame store or 'cam' to use webcam feed.
+        input_file: str, The file that contains the input image or video file. For cam input_type
+                    the index of the camera, leave empty for the default camera. For image
+                    input_type also a directory or a glob pattern of images.
+        skip_policy: str, Which decoded frames are returned, one of SKIP_POLICIES.
+        skip: int, Keep every skip-th frame when skip_policy is 'nth'.
+        buffer_size: int, How many decoded frames are kept ahead of the caller.
+        recorder: SpanRecorder, Receives a decode span per returned frame, covering
+                  the decoding of the frames skipped before it too.
+        workers: int, Threads decoding images, the number of CPUs by default.
+        record: FrameStoreWriter, Receives every decoded frame of a video or webcam.
+        replay_speed: float, Multiple of the recorded speed a frame store is
+                      replayed at, 0 for as fast as possible.
         """
+        if skip_policy not in SKIP_POLICIES:
+            raise ValueError(
+                f"Unknown skip policy {skip_policy}, expected one of {SKIP_POLICIES}"
+            )
         self.input_type = input_type
-        if input_type == "video" or input_type == "image":
+        if input_type in ("video", "image", "replay"):
             self.input_file = input_file
+        elif input_type == "cam":
+            self.camera_index = int(input_file) if input_file else 0
+        self.skip_policy = skip_policy
+        self.skip = max(1, skip)
+        self.buffer = deque(maxlen=max(1, buffer_size))
+        self.condition = threading.Condition()
+        self.finished = False
+        self.stopped = False
+        self.reader = None
+        self.recorder = recorder
+        self.frames_returned = 0
+        self.workers = workers or os.cpu_count()
+        self.decoder = None
+        self.record = record
+        self.replay_speed = replay_speed
+        self.store = None
+        self.position = 0
+        self.replay_start_ns = None
 
     def load_data(self):
         if self.input_type == "video":
             self.cap = cv2.VideoCapture(self.input_file)
         elif self.input_type == "cam":
-            self.cap = cv2.VideoCapture(0)
+            self.cap = cv2.VideoCapture(self.camera_index)
+        elif self.input_type == "replay":
+            self.store = FrameStore(self.input_file)
+            self.properties = {
+                cv2.CAP_PROP_FRAME_WIDTH: self.store.width,
+                cv2.CAP_PROP_FRAME_HEIGHT: self.store.height,
+                cv2.CAP_PROP_FRAME_COUNT: len(self.store),
+                cv2.CAP_PROP_FPS: self.store.fps,
+            }
+            return
         else:
-            self.cap = cv2.imread(self.input_file)
+            self.paths = image_paths(self.input_file)
+            first = cv2.imread(self.paths[0]) if self.paths else None
+            height, width = first.shape[:2] if first is not None else (0, 0)
+            self.properties = {
+                cv2.CAP_PROP_FRAME_WIDTH: width,
+                cv2.CAP_PROP_FRAME_HEIGHT: height,
+                cv2.CAP_PROP_FRAME_COUNT: len(self.paths),
+                cv2.CAP_PROP_FPS: 0,
+            }
+            return
+
+        # The capture is only touched by the reader thread from now on.
+        self.properties = {
+            prop: self.cap.get(prop)
+            for prop in [
+                cv2.CAP_PROP_FRAME_WIDTH,
+                cv2.CAP_PROP_FRAME_HEIGHT,
+                cv2.CAP_PROP_FRAME_COUNT,
+                cv2.CAP_PROP_FPS,
+            ]
+        }
+        if self.record is not None and self.input_type == "video":
+            self.record.fps = self.properties[cv2.CAP_PROP_FPS]
+        self.reader = threading.Thread(target=self.read_frames, daemon=True)
+        self.reader.start()
+
+    def read_frames(self):
+        index = 0
+        start_ns = time.perf_counter_ns()
+        while True:
+            flag, frame = self.cap.read()
+            if not flag:
+                break
+            if self.record is not None:
+                self.record.write(frame, self.timestamp_ns(index))
+            index += 1
+            if self.skip_policy == "nth" and index % self.skip != 0:
+                continue
+            end_ns = time.perf_counter_ns()
+            with self.condition:
+                # Only the latest policy may overwrite frames nobody read yet,
+                # the other ones wait for the caller to catch up.
+                while (
+                    not self.stopped
+                    and self.skip_policy != "latest"
+                    and len(self.buffer) == self.buffer.maxlen
+                ):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                self.buffer.append((frame, start_ns, end_ns))
+                self.condition.notify_all()
+            start_ns = time.perf_counter_ns()
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def timestamp_ns(self, index):
+        """
+        Returns the recording timestamp of the index-th decoded frame, its
+        media time for videos and the time it was read for webcams.
+        """
+        fps = self.properties[cv2.CAP_PROP_FPS]
+        if self.input_type == "video" and fps > 0:
+            return int(index * 1e9 / fps)
+        return time.perf_counter_ns()
+
+    def replay_frame(self):
+        """
+        Returns the next frame of a frame store, or None once it is exhausted.
+        """
+        now_ns = time.perf_counter_ns()
+        if self.replay_start_ns is None:
+            self.replay_start_ns = now_ns
+        timestamps = self.store.timestamps
+        index = self.position
+        if self.skip_policy == "nth":
+            index += self.skip - 1
+        elif self.skip_policy == "latest" and self.replay_speed > 0:
+            elapsed_ns = (now_ns - self.replay_start_ns) * self.replay_speed
+            latest = int(np.searchsorted(timestamps, elapsed_ns, side="right")) - 1
+            index = max(index, latest)
+        if index >= len(self.store):
+            return None
+        if self.replay_speed > 0:
+            due_ns = self.replay_start_ns + timestamps[index] / self.replay_speed
+            if due_ns > now_ns:
+                time.sleep((due_ns - now_ns) / 1e9)
+        self.position = index + 1
+        start_ns = time.perf_counter_ns()
+        frame = self.store.frame(index)
+        self.recorder.add(
+            self.frames_returned,
+            "decode",
+            "InputFeeder",
+            start_ns,
+            time.perf_counter_ns(),
+        )
+        self.frames_returned += 1
+        return frame
+
+    def next_frame(self):
+        """
+        Returns the next decoded frame, or None once the input is exhausted.
+        """
+        if self.input_type == "replay":
+            return self.replay_frame()
+        with self.condition:
+            while not self.buffer and not self.finished and not self.stopped:
+                self.condition.wait()
+            if not self.buffer:
+                return None
+            if self.skip_policy == "latest":
+                frame, start_ns, end_ns = self.buffer.pop()
+                self.buffer.clear()
+            else:
+                frame, start_ns, end_ns = self.buffer.popleft()
+            self.condition.notify_all()
+        self.recorder.add(
+            self.frames_returned, "decode", "InputFeeder", start_ns, end_ns
+        )
+        self.frames_returned += 1
+        return frame
+
+    def decode_images(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            paths = iter(self.paths)
+            try:
+                while True:
+                    # Keep the pool busy without decoding the whole set up front.
+                    while len(pending) < self.workers * self.buffer.maxlen:
+                        path = next(paths, None)
+                        if path is None:
+                            break
+                        pending.append((path, executor.submit(read_image, path)))
+                    if not pending:
+                        return
+                    path, future = pending.popleft()
+                    image, start_ns, end_ns = future.result()
+                    if image is None:
+                        logging.warning(f"Could not read the image {path}")
+                    else:
+                        self.recorder.add(
+                            self.frames_returned,
+                            "decode",
+                            "InputFeeder",
+                            start_ns,
+                            end_ns,
+                        )
+                    self.frames_returned += 1
+                    yield path, image
+            finally:
+                # Images nobody will read are not decoded when the caller stops early.
+                for _, future in pending:
+                    future.cancel()
+
+    def next_images(self):
+        """
+        Yields the path and decoded image of every image of an image input,
+        the image is None when it could not be read.
+        """
+        self.decoder = self.decode_images()
+        yield from self.decoder
 
     def next_batch(self):
         """
         Returns the next image from either a video file or webcam.
-        If input_type is 'image', then it returns the same image.
+        If input_type is 'image', then it returns every readable image once.
         """
+        if self.input_type == "image":
+            for _, image in self.next_images():
+                if image is not None:
+                    yield True, image
+            return
         while True:
-            for _ in range(10):
-                _, frame = self.cap.read()
-            yield _, frame
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield True, frame
 
     def frame_initials_and_length(self):
-        initial_w = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        initial_h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        video_len = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        initial_w = int(self.properties[cv2.CAP_PROP_FRAME_WIDTH])
+        initial_h = int(self.properties[cv2.CAP_PROP_FRAME_HEIGHT])
+        video_len = int(self.properties[cv2.CAP_PROP_FRAME_COUNT])
         return initial_w, initial_h, video_len
 
     def fps(self):
-        fps = int(self.cap.get(cv2.CAP_PROP_FPS))
+        fps = int(self.properties[cv2.CAP_PROP_FPS])
         return fps
 
     def close(self):
         """
-        Closes the VideoCapture.
+        Stops the reader thread, closes the VideoCapture and completes the
+        recording.
         """
-        if not self.input_type == "image":
+        if self.input_type == "image":
+            if self.decoder is not None:
+                self.decoder.close()
+        elif self.input_type == "replay":
+            self.store = None
+        else:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+            if self.reader is not None:
+                self.reader.join()
             self.cap.release()
+            if self.record is not None:
+                frames = self.record.close()
+                logging.info(f"Recorded {frames} frames to {self.record.path}")
@@ -0,0 +1,137 @@
+"""
+Per-frame, per-stage latency spans.
+Every span is a (frame_id, stage, component, start_ns, end_ns) record taken
+with time.perf_counter_ns. Stages are decode, preprocess, infer, postprocess,
+draw, encode and actuate; component tells which model (or other part of the
+pipeline) the span belongs to. The recorder summarises the spans into
+percentiles per stage and exports them as JSON or CSV.
+A disabled recorder (NULL_RECORDER) hands out one shared no-op span, so
+instrumented code costs next to nothing when profiling is off.
+Sample usage:
+    recorder = SpanRecorder()
+    with recorder.span(frame_id, "infer", "Model_FaceDetection"):
+        do_something()
+    recorder.export_json("latency.json")
+"""
+import csv
+import json
+import time
+
+import numpy as np
+
+STAGES = ["decode", "preprocess", "infer", "postprocess", "draw", "encode", "actuate"]
+PERCENTILES = [50, 95, 99]
+
+
+class Span:
+    def __init__(self, recorder, frame_id, stage, component):
+        self.recorder = recorder
+        self.frame_id = frame_id
+        self.stage = stage
+        self.component = component
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add(
+            self.frame_id,
+            self.stage,
+            self.component,
+            self.start_ns,
+            time.perf_counter_ns(),
+        )
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class SpanRecorder:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.spans = []
+
+    def span(self, frame_id, stage, component=""):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, frame_id, stage, component)
+
+    def add(self, frame_id, stage, component, start_ns, end_ns):
+        if self.enabled:
+            # list.append is atomic, spans can be added from any thread.
+            self.spans.append((frame_id, stage, component, start_ns, end_ns))
+
+    def summary(self):
+        """
+        Returns {"<component>.<stage>": stats} with the count, mean, max and
+        percentiles of the span durations in milliseconds.
+        """
+        durations = {}
+        for _, stage, component, start_ns, end_ns in self.spans:
+            key = f"{component}.{stage}" if component else stage
+            durations.setdefault(key, []).append(end_ns - start_ns)
+
+        summary = {}
+        for key, values in sorted(durations.items()):
+            values = np.array(values) / 1e6
+            stats = {
+                "count": len(values),
+                "mean_ms": float(values.mean()),
+                "max_ms": float(values.max()),
+            }
+            for percentile, value in zip(
+                PERCENTILES, np.percentile(values, PERCENTILES)
+            ):
+                stats[f"p{percentile}_ms"] = float(value)
+            summary[key] = stats
+        return summary
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "summary": self.summary(),
+                    "spans": [
+                        {
+                            "frame_id": frame_id,
+                            "stage": stage,
+                            "component": component,
+                            "start_ns": start_ns,
+                            "end_ns": end_ns,
+                        }
+                        for frame_id, stage, component, start_ns, end_ns in self.spans
+                    ],
+                },
+                f,
+                indent=2,
+            )
+
+    def export_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["frame_id", "stage", "component", "start_ns", "end_ns", "duration_ms"]
+            )
+            for frame_id, stage, component, start_ns, end_ns in self.spans:
+                writer.writerow(
+                    [
+                        frame_id,
+                        stage,
+                        component,
+                        start_ns,
+                        end_ns,
+                        (end_ns - start_ns) / 1e6,
+                    ]
+                )
+
+
+NULL_RECORDER = SpanRecorder(enabled=False)
@@ -1,24 +1,78 @@
+import threading
+import time
+
 import numpy as np
 
 import cv2
-from openvino.inference_engine import IECore
+import model_cache
+import postprocessing
+from backends import RUNTIMES, create_core
+from instrumentation import NULL_RECORDER
+
+runtime = "openvino"
+stub_latency_scale = 1.0
+core = None
+core_extensions = set()
+core_lock = threading.Lock()
+
+
+def use_runtime(name, latency_scale=1.0):
+    """
+    Selects the inference runtime of the models created from now on, one of
+    backends.RUNTIMES. latency_scale multiplies the synthetic latencies of
+    the stub runtime.
+    """
+    global runtime, stub_latency_scale, core
+    if name not in RUNTIMES:
+        raise ValueError(f"Unknown runtime {name}, expected one of {RUNTIMES}")
+    with core_lock:
+        if name != runtime or latency_scale != stub_latency_scale:
+            core = None
+            core_extensions.clear()
+        runtime = name
+        stub_latency_scale = latency_scale
+
+
+def get_core(extensions=None, device="CPU"):
+    """
+    Returns the IECore shared by every model of the process, creating it on
+    first use and adding the CPU extensions only once.
+    """
+    global core
+    with core_lock:
+        if core is None:
+            core = create_core(runtime, stub_latency_scale)
+        if extensions and "CPU" in device and extensions not in core_extensions:
+            core.add_extension(extensions, "CPU")
+            core_extensions.add(extensions)
+        return core
 
 
 class Model:
-    def __init__(self, model, device, extensions=None):
+    def __init__(
+        self, model, device, extensions=None, num_requests=1, max_batch_size=1
+    ):
         self.model_weights = model + ".bin"
         self.model_structure = model + ".xml"
         self.device = device
         self.extensions = extensions
+        self.num_requests = num_requests
+        self.max_batch_size = max_batch_size
+        self.next_request_id = 0
+        self.resized = None
+        # Set by the caller to attribute the spans of this model to a frame.
+        self.recorder = NULL_RECORDER
+        self.frame_id = None
+        self.started = {}
 
         try:
-            self.core = IECore()
-            if self.extensions and "CPU" in self.device:
-                self.core.add_extension(self.extensions, self.device)
+            self.core = get_core(self.extensions, self.device)
 
             self.model = self.core.read_network(
                 model=self.model_structure, weights=self.model_weights
             )
+            if self.max_batch_size > 1:
+                self.model.batch_size = self.max_batch_size
         except Exception as e:
             raise ValueError(
                 f"Could not Initialise the network. Have you enterred the correct model path? Got this error ~ {e}"
@@ -28,12 +82,72 @@ class Model:
         self.input_shape = self.model.inputs[self.input_name].shape
         self.output_name = next(iter(self.model.outputs))
         self.output_shape = self.model.outputs[self.output_name].shape
+        self.name = type(self).__name__
 
-    def load_model(self):
-        self.net = self.core.load_network(
-            network=self.model, device_name=self.device, num_requests=1
+    def load_model(self, cache_dir=None):
+        config = {}
+        if self.max_batch_size > 1:
+            # Lets every infer request run with fewer items than the batch
+            # size the network was reshaped to, see start_request. Passed per
+            # network, the core is shared by models loading in parallel.
+            config["DYN_BATCH_ENABLED"] = "YES"
+        self.net = model_cache.load_network(
+            self.core,
+            self.model,
+            self.model_structure,
+            self.model_weights,
+            self.device,
+            self.num_requests,
+            cache_dir,
+            {"max_batch_size": self.max_batch_size, "extensions": self.extensions},
+            config,
         )
 
+    def next_request(self):
+        """
+        Returns the id of the next infer request slot. Slots are handed out
+        round robin, so callers must not keep more than num_requests
+        inferences of this model in flight at once.
+        """
+        request_id = self.next_request_id
+        self.next_request_id = (request_id + 1) % self.num_requests
+        return request_id
+
+    def input_blob(self, request_id, input_name=None):
+        """
+        Returns the NCHW input buffer of the infer request as a numpy array, so
+        the inputs are written in place instead of being copied in on start.
+        """
+        infer_request = self.net.requests[request_id]
+        return infer_request.input_blobs[input_name or self.input_name].buffer
+
+    def start_request(self, request_id, batch_size=1):
+        """
+        Starts the infer request on the inputs already written to its blobs.
+        batch_size limits a batched network to the first items of its inputs.
+        """
+        infer_request = self.net.requests[request_id]
+        if self.max_batch_size > 1:
+            infer_request.set_batch(batch_size)
+        if self.recorder.enabled:
+            self.started[request_id] = (self.frame_id, time.perf_counter_ns())
+        infer_request.async_infer()
+
+    def wait(self, request_id):
+        """
+        Blocks until the given infer request is done and returns its outputs,
+        or None if the inference failed.
+        """
+        infer_request = self.net.requests[request_id]
+        status = infer_request.wait()
+        if request_id in self.started:
+            frame_id, start_ns = self.started.pop(request_id)
+            self.recorder.add(
+                frame_id, "infer", self.name, start_ns, time.perf_counter_ns()
+            )
+        if status == 0:
+            return infer_request.outputs
+
     def check_model(self):
         supported_layers = self.core.query_network(
             network=self.model, device_name=self.device
@@ -48,19 +162,44 @@ class Model:
         return
 
     def preprocess_outputs(self, outputs, threshold=0.6):
-        coords = []
-        for coord in outputs[0][0]:
-            if coord[2] >= threshold:
-                coords.append(coord[3:])
+        _, coords = postprocessing.threshold_detections(outputs, threshold)
         return coords
 
-    def preprocess_input(self, image):
-        input_img = image
-        input_img = cv2.resize(
-            input_img,
-            (self.input_shape[3], self.input_shape[2]),
-            interpolation=cv2.INTER_AREA,
-        )
-        input_img = np.moveaxis(input_img, -1, 0)
-        input_dict = {self.input_name: input_img}
-        return input_dict
+    def resize_into(self, image, blob):
+        """
+        Resizes the HWC image into the model's reused resize buffer and copies
+        it into one CHW item of an input blob. Images that already have the
+        input size are copied without resizing.
+        """
+        height, width = blob.shape[1], blob.shape[2]
+        if image.shape[:2] != (height, width):
+            if (
+                self.resized is None
+                or self.resized.shape[:2] != (height, width)
+                or self.resized.dtype != image.dtype
+            ):
+                self.resized = np.empty((height, width, 3), dtype=image.dtype)
+            cv2.resize(
+                image, (width, height), dst=self.resized, interpolation=cv2.INTER_AREA
+            )
+            image = self.resized
+        np.copyto(blob, image.transpose(2, 0, 1), casting="unsafe")
+
+    def fill_input(self, request_id, images):
+        with self.recorder.span(self.frame_id, "preprocess", self.name):
+            blob = self.input_blob(request_id)
+            for i, image in enumerate(images):
+                self.resize_into(image, blob[i])
+
+    def infer_images(self, images):
+        request_id = self.next_request()
+        self.fill_input(request_id, images)
+        self.start_request(request_id, len(images))
+        return self.wait(request_id)
+
+    def chunks(self, items):
+        """
+        Splits items into lists of at most max_batch_size items.
+        """
+        for i in range(0, len(items), self.max_batch_size):
+            yield items[i : i + self.max_batch_size]
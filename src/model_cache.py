@@ -0,0 +1,101 @@
+"""
+On-disk cache of compiled networks.
+Compiling a network for a device is the slow part of loading a model, so the
+compiled network is exported once and imported on the next start. Entries are
+keyed by the model path, precision, device, load settings and a hash of the
+.xml and .bin files, so a changed model or setting never picks up a stale
+entry. A new entry only replaces the entries of the same model path, device
+and settings, those of other settings or of a same-named model elsewhere
+stay. Devices whose plugin cannot export compiled networks simply load the
+network as before.
+"""
+import glob
+import hashlib
+import logging
+import os
+import uuid
+
+
+def cache_path(cache_dir, model_structure, model_weights, device, settings):
+    """
+    Returns <name>-<precision>-<device>-<key>-<content>.blob, where key hashes
+    the model path, device and settings and content the model files.
+    """
+    key = hashlib.sha256()
+    key.update(os.path.abspath(model_structure).encode())
+    key.update(device.encode())
+    key.update(repr(sorted(settings.items())).encode())
+    content = hashlib.sha256()
+    for path in [model_structure, model_weights]:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                content.update(chunk)
+    name = os.path.splitext(os.path.basename(model_structure))[0]
+    precision = os.path.basename(os.path.dirname(model_structure))
+    return os.path.join(
+        cache_dir,
+        f"{name}-{precision}-{device}-{key.hexdigest()[:16]}"
+        f"-{content.hexdigest()[:16]}.blob",
+    )
+
+
+def load_network(
+    core,
+    network,
+    model_structure,
+    model_weights,
+    device,
+    num_requests,
+    cache_dir,
+    settings,
+    config=None,
+):
+    """
+    Returns the executable network, imported from cache_dir when cached.
+    config holds the plugin settings of this network only.
+    """
+    config = config or {}
+    if not cache_dir:
+        return core.load_network(
+            network=network,
+            device_name=device,
+            config=config,
+            num_requests=num_requests,
+        )
+
+    blob_path = cache_path(cache_dir, model_structure, model_weights, device, settings)
+    if os.path.exists(blob_path):
+        try:
+            return core.import_network(
+                model_file=blob_path,
+                device_name=device,
+                config=config,
+                num_requests=num_requests,
+            )
+        except Exception as e:
+            logging.warning(f"Could not import cached network {blob_path} ~ {e}")
+
+    net = core.load_network(
+        network=network, device_name=device, config=config, num_requests=num_requests
+    )
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Entries of older versions of this model are never hit again.
+        prefix = blob_path.rsplit("-", 1)[0]
+        for stale_path in glob.glob(glob.escape(prefix) + "-*.blob"):
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+        # Concurrent workers exporting the same network each write their own
+        # file, the last rename wins.
+        tmp_path = f"{blob_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        try:
+            net.export(tmp_path)
+            os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except Exception as e:
+        logging.info(f"Not caching the compiled network for {device} ~ {e}")
+    return net
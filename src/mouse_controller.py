@@ -1,26 +1,118 @@
 """
 This is a sample class that you can use to control the mouse pointer.
 It uses the pyautogui library. You can set the precision for mouse movement
-(how much the mouse moves) and the speed (how fast it moves) by changing 
+(how much the mouse moves) and the speed (how fast it moves) by changing
 precision_dict and speed_dict.
 Calling the move function with the x and y output of the gaze estimation model
 will move the pointer.
+The pointer is moved by a background thread so move never blocks the caller.
+Moves are relative, so a new move adds whatever is left of the previous ones
+to its own distance, and the thread interpolates the sum over `speed` seconds
+at a fixed rate. Pass RecorderBackend() as backend to record the moves in
+memory instead of moving the real pointer, e.g. to measure latency without a
+display.
 This class is provided to help get you started; you can choose whether you want to use it or create your own from scratch.
 """
-import pyautogui
+import threading
+import time
+from collections import deque
 
-pyautogui.FAILSAFE = False
+
+class PyAutoGuiBackend:
+    def __init__(self):
+        import pyautogui
+
+        pyautogui.FAILSAFE = False
+        self.pyautogui = pyautogui
+
+    def move_rel(self, x, y):
+        self.pyautogui.moveRel(x, y, _pause=False)
+
+
+class RecorderBackend:
+    def __init__(self):
+        self.moves = []
+
+    def move_rel(self, x, y):
+        self.moves.append((time.time(), x, y))
 
 
 class MouseController:
-    def __init__(self, precision, speed):
+    def __init__(self, precision, speed, backend=None, rate=60):
         precision_dict = {"high": 100, "low": 1000, "medium": 500}
         speed_dict = {"fast": 1, "slow": 10, "medium": 5}
 
         self.precision = precision_dict[precision]
         self.speed = speed_dict[speed]
+        self.backend = backend if backend is not None else PyAutoGuiBackend()
+        self.interval = 1 / rate
+        # Seconds between a move request and the first pointer step for it.
+        self.latencies = deque(maxlen=1000)
+
+        self.target = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.actuate, daemon=True)
+        self.thread.start()
 
     def move(self, x, y):
-        pyautogui.moveRel(
-            x * self.precision, -1 * y * self.precision, duration=self.speed
-        )
+        x, y = x * self.precision, -1 * y * self.precision
+        with self.condition:
+            if self.target is not None:
+                # Not started yet, the latency counts from the first request.
+                x_pending, y_pending, requested_at = self.target
+                self.target = (x_pending + x, y_pending + y, requested_at)
+            else:
+                self.target = (x, y, time.time())
+            self.condition.notify()
+
+    def actuate(self):
+        x_left = y_left = 0.0
+        x_carry = y_carry = 0.0
+        steps_left = 0
+        requested_at = None
+        next_tick = time.time()
+        while True:
+            with self.condition:
+                while self.running and self.target is None and steps_left == 0:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                if self.target is not None:
+                    # The rest of the previous move is not dropped, the
+                    # pointer would otherwise fall short of the gaze.
+                    x_target, y_target, requested_at = self.target
+                    x_left += x_target
+                    y_left += y_target
+                    self.target = None
+                    steps_left = max(1, round(self.speed / self.interval))
+                    next_tick = max(next_tick, time.time())
+
+            x_step = x_left / steps_left
+            y_step = y_left / steps_left
+            x_left -= x_step
+            y_left -= y_step
+            steps_left -= 1
+
+            # The pointer only moves by whole pixels, keep the fractions for
+            # the next steps so slow moves are not lost to rounding.
+            x_carry += x_step
+            y_carry += y_step
+            x_move = int(x_carry)
+            y_move = int(y_carry)
+            x_carry -= x_move
+            y_carry -= y_move
+            if x_move or y_move:
+                self.backend.move_rel(x_move, y_move)
+            if requested_at is not None:
+                self.latencies.append(time.time() - requested_at)
+                requested_at = None
+
+            next_tick += self.interval
+            time.sleep(max(0, next_tick - time.time()))
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
@@ -0,0 +1,9 @@
+"""
+Choices of the command line options.
+They live apart from the modules that implement them because this module
+imports nothing, so the argument parser and the argument checks of
+pipeline.py run before NumPy, OpenCV or an inference runtime is loaded.
+"""
+SKIP_POLICIES = ["nth", "all", "latest"]
+RUNTIMES = ["openvino", "onnxruntime", "opencv", "stub"]
+RESULT_FORMATS = ["npz", "csv"]
@@ -1,41 +1,72 @@
+import glob
+import importlib
 import logging
 import os
 import sys
 import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
-import cv2
-from face_detection import Model_FaceDetection
-from facial_landmarks_detection import Model_FacialLandMarkDetection
-from gaze_estimation import Model_GazeEstimation
-from head_pose_estimation import Model_HeadPoseEstimation
-from input_feeder import InputFeeder
-from mouse_controller import MouseController
+from options import RESULT_FORMATS, RUNTIMES, SKIP_POLICIES
 
+# The stage modules, NumPy, OpenCV and the inference runtime are imported by
+# the functions that use them, after the arguments were parsed and checked.
+# Start of the startup profile.
+startup_start_time = time.time()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 model_path_generator = lambda x: os.path.join(BASE_DIR, "models", x)
 input_path_generator = lambda x: os.path.join(BASE_DIR, "bin", x)
 output_path_generator = lambda x: os.path.join(BASE_DIR, "results", x)
 log_path_generator = lambda x: os.path.join(BASE_DIR, "logs", x)
+# Model directory of every precision, the face detector only comes in FP32-INT1.
+PRECISION_DIRS = {"FP32": "FP32", "FP16": "FP16", "INT8": "FP16-INT8"}
+# Files a runtime reads for a model path, any one of the alternatives.
+MODEL_FILES = {
+    "openvino": [[".xml", ".bin"]],
+    "onnxruntime": [[".onnx"]],
+    # OpenCV DNN reads the input and output layout from the IR .xml.
+    "opencv": [[".xml", ".onnx"], [".xml", ".bin"]],
+    "stub": [[]],
+}
+RUNTIME_MODULES = {
+    "openvino": "openvino.inference_engine",
+    "onnxruntime": "onnxruntime",
+    "opencv": "cv2",
+    "stub": "stub_runtime",
+}
 log_file_location = log_path_generator("App.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler(log_file_location), logging.StreamHandler()],
-)
 
 model_dict = None
+precision_models = None
 input_path = None
 output_path = None
 device = None
 cpu_extension = None
 prob_threshold = None
 flags = None
+num_requests = None
+max_faces = None
+top_k = None
+nms_threshold = None
+detection_interval = None
+smooth = None
+motion_threshold = None
+render_interval = None
+target_fps = None
+image_batch = None
+model_cache_dir = None
 mouse_controller = None
 feeder = None
-video_writer = None
+video_encoder = None
+stage_cache = None
+publisher = None
+recorder = None
+headless = None
+results_writer = None
 model_loading_total_time = None
 model_inference_total_time = None
+# Seconds spent per startup phase, logged once on the first result.
+startup_times = {}
 
 
 def build_argparser():
@@ -73,7 +104,8 @@ def build_argparser():
         "--input",
         required=True,
         type=str,
-        help="Path to image or video file or camera feed usage direction."
+        help="Path to image or video file, a directory or glob pattern of "
+        "images, or camera feed usage direction."
         "For camera feed please pass 'CAM' keyword",
     )
     parser.add_argument(
@@ -115,157 +147,888 @@ def build_argparser():
         help="Specify flag with one or more model flags separated by space"
         "flags can be used fdm fldm hpem gem like -f fdm or -f fdm fldm etc",
     )
+    parser.add_argument(
+        "-rt",
+        "--runtime",
+        choices=RUNTIMES,
+        default="openvino",
+        help="Inference runtime. onnxruntime and opencv run <model>.onnx next "
+        "to the IR files (opencv falls back to the IR files), stub runs NumPy "
+        "stand-ins of the models with synthetic latencies and needs no model "
+        "files (openvino by default)",
+    )
+    parser.add_argument(
+        "--stub_latency_scale",
+        type=float,
+        default=1.0,
+        help="Factor applied to the synthetic latencies of the stub runtime "
+        "(1.0 by default)",
+    )
+    parser.add_argument(
+        "-nr",
+        "--num_requests",
+        type=int,
+        default=2,
+        help="Number of infer requests kept in flight per model. Frames are "
+        "pipelined through the models when greater than 1 (2 by default)",
+    )
+    parser.add_argument(
+        "-mf",
+        "--max_faces",
+        type=int,
+        default=1,
+        help="Maximum number of faces batched through the landmark, head pose "
+        "and gaze models in one inference (1 by default)",
+    )
+    parser.add_argument(
+        "-tk",
+        "--top_k",
+        type=int,
+        default=None,
+        help="Keep only the K most confident faces of a frame (all by default)",
+    )
+    parser.add_argument(
+        "-nms",
+        "--nms_threshold",
+        type=float,
+        default=None,
+        help="IoU above which overlapping face detections are suppressed "
+        "(no suppression by default)",
+    )
+    parser.add_argument(
+        "-sp",
+        "--skip_policy",
+        choices=SKIP_POLICIES,
+        default=None,
+        help="Which decoded frames are processed: every Nth frame, all frames "
+        "or only the latest frame (latest for CAM and nth otherwise by default)",
+    )
+    parser.add_argument(
+        "-fs",
+        "--frame_skip",
+        type=int,
+        default=10,
+        help="Process every Nth frame when the skip policy is nth (10 by default)",
+    )
+    parser.add_argument(
+        "-di",
+        "--detection_interval",
+        type=int,
+        default=1,
+        help="Run the face detector every N processed frames and track the "
+        "faces in between, 1 detects on every frame (1 by default)",
+    )
+    parser.add_argument(
+        "--smooth",
+        action="store_true",
+        help="Filter the head pose angles and gaze vectors of every face over "
+        "time with a One-Euro filter for a steadier pointer",
+    )
+    parser.add_argument(
+        "-mt",
+        "--motion_threshold",
+        type=float,
+        default=0.0,
+        help="Reuse the last landmarks, head pose and gaze of a face while its "
+        "crop changed less than this mean fraction of the pixel range since "
+        "its last inference, e.g. 0.02 (0 disables it by default)",
+    )
+    parser.add_argument(
+        "-tf",
+        "--target_fps",
+        type=float,
+        default=0,
+        help="Input frames per second to keep up with by lowering the "
+        "precision, detecting less often, processing fewer faces and skipping "
+        "frames while the pipeline is too slow, and raising them again when "
+        "it catches up (0 disables it by default)",
+    )
+    parser.add_argument(
+        "-pr",
+        "--precisions",
+        nargs="+",
+        choices=list(PRECISION_DIRS),
+        default=[],
+        help="Lower precisions of the landmark, head pose and gaze models "
+        "preloaded for --target_fps, best first, e.g. FP16 INT8",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Batch mode without display, key wait or mouse control. The gaze "
+        "vectors, boxes and angles are written to results.<format> in the "
+        "output directory, no output video is rendered or encoded",
+    )
+    parser.add_argument(
+        "-ib",
+        "--image_batch",
+        type=int,
+        default=8,
+        help="Images of an image input processed together, their faces share "
+        "the landmark, head pose and gaze batches (8 by default)",
+    )
+    parser.add_argument(
+        "-dw",
+        "--decode_workers",
+        type=int,
+        default=None,
+        help="Threads decoding the images of an image input (number of CPUs "
+        "by default)",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="Record every decoded frame of a video or camera input into this "
+        "frame store under bin, which can be replayed with -i <name>.frames",
+    )
+    parser.add_argument(
+        "--record_resize",
+        action="store_true",
+        help="Resize the recorded frames to the input size of the face "
+        "detection model",
+    )
+    parser.add_argument(
+        "--replay_speed",
+        type=float,
+        default=0,
+        help="Replay a .frames input at this multiple of its recorded speed, "
+        "e.g. 1 for the original timestamps (0 replays it as fast as possible "
+        "by default)",
+    )
+    parser.add_argument(
+        "-rf",
+        "--results_format",
+        choices=RESULT_FORMATS,
+        default="npz",
+        help="File format of the headless results (npz by default)",
+    )
+    parser.add_argument(
+        "-vc",
+        "--video_codec",
+        type=str,
+        default="avc1",
+        help="Fourcc of the output video codec, e.g. avc1 or mp4v for .mp4 and "
+        "MJPG for .avi (avc1 by default)",
+    )
+    parser.add_argument(
+        "--hw_encode",
+        action="store_true",
+        help="Encode the output video on a hardware encoder when available",
+    )
+    parser.add_argument(
+        "-eq",
+        "--encoder_queue",
+        type=int,
+        default=8,
+        help="Frames waiting for the video encoder before new frames are "
+        "dropped (8 by default)",
+    )
+    parser.add_argument(
+        "--metadata_only",
+        action="store_true",
+        help="Do not encode the output video, only list the processed frames "
+        "in frames.csv",
+    )
+    parser.add_argument(
+        "--headless_video",
+        action="store_true",
+        help="Render and encode the output video in --headless mode too",
+    )
+    parser.add_argument(
+        "-ri",
+        "--render_interval",
+        type=int,
+        default=1,
+        help="Render, display and encode only every nth processed frame "
+        "(1 by default)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Record per-frame latency spans of every stage, log their "
+        "percentiles and export them to latency.json and latency.csv in the "
+        "output directory",
+    )
+    parser.add_argument(
+        "-mc",
+        "--model_cache",
+        type=str,
+        default="cache",
+        help="Directory under models where compiled networks are cached to "
+        "speed up the next start ('cache' by default)",
+    )
+    parser.add_argument(
+        "--no_model_cache",
+        action="store_true",
+        help="Compile the networks on every start instead of using the cache",
+    )
+    parser.add_argument(
+        "-sc",
+        "--stage_cache",
+        type=str,
+        default=None,
+        help="Directory under results where the results of every stage are "
+        "cached, so re-runs on the same video only infer the stages whose "
+        "models or parameters changed (disabled by default)",
+    )
+    parser.add_argument(
+        "--stage_cache_size",
+        type=int,
+        default=512,
+        help="Size in MB above which the least recently used stage cache "
+        "entries are deleted (512 by default)",
+    )
+    parser.add_argument(
+        "--publish_shm",
+        type=str,
+        default=None,
+        help="Publish the faces of every processed frame to a shared memory "
+        "ring of this name, read it with gaze_publisher.py --shm <name>",
+    )
+    parser.add_argument(
+        "--publish_socket",
+        type=str,
+        default=None,
+        help="Publish the faces of every processed frame on a Unix domain "
+        "socket at this path, read it with gaze_publisher.py --socket <path>",
+    )
+    parser.add_argument(
+        "--publish_capacity",
+        type=int,
+        default=1024,
+        help="Face records kept in the shared memory ring (1024 by default)",
+    )
     return parser
 
 
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.FileHandler(log_file_location), logging.StreamHandler()],
+    )
+
+
+def missing_model_files(arg, runtime):
+    """
+    Returns the files of the model path the runtime needs but cannot find.
+    """
+    model = model_path_generator(arg)
+    missing = []
+    for extensions in MODEL_FILES[runtime]:
+        missing = [
+            model + extension
+            for extension in extensions
+            if not os.path.exists(model + extension)
+        ]
+        if not missing:
+            return []
+    return missing
+
+
+def check_args(args, check_input=True):
+    """
+    Logs every problem of the arguments and exits if there is one, before
+    anything heavy is imported or loaded.
+    """
+    problems = []
+    model_args = [
+        args.face_detection_model,
+        args.facial_landmarks_detection_model,
+        args.head_pose_estimation_model,
+        args.gaze_estimation_model,
+    ]
+    if args.target_fps > 0:
+        for precision in args.precisions:
+            if precision_of(args.gaze_estimation_model) is None:
+                problems.append(f"Cannot derive the {precision} model paths")
+                break
+            model_args += [with_precision(arg, precision) for arg in model_args[1:4]]
+    for arg in model_args:
+        for path in missing_model_files(arg, args.runtime):
+            problems.append(f"Model file {path} does not exist")
+    if args.cpu_extension and not os.path.exists(args.cpu_extension):
+        problems.append(f"CPU extension {args.cpu_extension} does not exist")
+    if not 0 <= args.prob_threshold <= 1:
+        problems.append(f"Probability threshold {args.prob_threshold} is not in [0, 1]")
+    if args.replay_speed < 0:
+        problems.append(f"Replay speed {args.replay_speed} is negative")
+    if check_input and args.input != "CAM":
+        path = input_path_generator(args.input)
+        if not (glob.glob(path) if glob.has_magic(path) else os.path.exists(path)):
+            problems.append(f"Input {path} does not exist")
+    for problem in problems:
+        logging.error(problem)
+    if problems:
+        sys.exit(1)
+
+
+def import_stages(args):
+    """
+    Imports the modules of the stages that run and the selected runtime up
+    front, so a missing runtime or display fails before the models load and
+    the import time is measured on its own.
+    """
+    start_time = time.time()
+    modules = [
+        "engine",
+        "face_detection",
+        "facial_landmarks_detection",
+        "head_pose_estimation",
+        "gaze_estimation",
+        "input_feeder",
+        "renderer",
+        "video_encoder",
+        RUNTIME_MODULES[args.runtime],
+    ]
+    if args.headless:
+        modules.append("results_writer")
+    else:
+        # pyautogui connects to the display when it is imported.
+        modules += ["mouse_controller", "pyautogui"]
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logging.error(f"Could not import {module} ~ {e}")
+            sys.exit(1)
+    startup_times["import"] = time.time() - start_time
+
+
+def log_startup_times():
+    logging.info("*********** Startup Time Start ***********")
+    for phase, name in [
+        ("import", "import"),
+        ("read", "network read (summed over the models)"),
+        ("compile", "compile (summed over the models)"),
+        ("load", "model loading"),
+        ("first_inference", "first inference"),
+        ("total", "total"),
+    ]:
+        if phase in startup_times:
+            logging.info(f"{name}: {1000 * startup_times[phase]:.1f} ms.")
+    logging.info("*********** Startup Time End ***********")
+
+
+def load_model(arg, m_class):
+    from face_detection import Model_FaceDetection
+
+    start_time = time.time()
+    model = model_path_generator(arg)
+    max_batch_size = max_faces if m_class is not Model_FaceDetection else 1
+    loaded_model = m_class(model, device, cpu_extension, num_requests, max_batch_size)
+    read_time = time.time() - start_time
+    if m_class is Model_FaceDetection:
+        loaded_model.top_k = top_k
+        loaded_model.nms_threshold = nms_threshold
+    loaded_model.load_model(model_cache_dir)
+    return loaded_model, read_time, time.time() - start_time
+
+
 def generate_model_dict(model_args, model_class):
     model_dict = {}
     logging.info("*********** Model Load Time Start ***************")
     start_loading = time.time()
-    for arg, m_class in zip(model_args, model_class):
+    with ThreadPoolExecutor(max_workers=len(model_class)) as executor:
+        futures = [
+            executor.submit(load_model, arg, m_class)
+            for arg, m_class in zip(model_args, model_class)
+        ]
+    for future, m_class in zip(futures, model_class):
         try:
-            start_time = time.time()
-            model = model_path_generator(arg)
-            model_dict[m_class.__name__] = m_class(model, device, cpu_extension)
-            model_dict[m_class.__name__].load_model()
-            end_time = time.time() - start_time
-            logging.info(f"{m_class.__name__}: {1000 * end_time:.1f} ms.")
+            model_dict[m_class.__name__], read_time, end_time = future.result()
+            logging.info(
+                f"{m_class.__name__}: {1000 * end_time:.1f} ms "
+                f"(read {1000 * read_time:.1f} ms)."
+            )
         except Exception as e:
             logging.error(f"Error while loading {m_class.__name__} ~ {e} ")
             sys.exit(1)
+        startup_times["read"] = startup_times.get("read", 0) + read_time
+        startup_times["compile"] = (
+            startup_times.get("compile", 0) + end_time - read_time
+        )
     end_loading = time.time() - start_loading
+    startup_times["load"] = startup_times.get("load", 0) + end_loading
     logging.info("*********** Model Load Time End ***************")
     return model_dict, end_loading
 
 
-def setup(args):
-    global input_path, output_path, device, cpu_extension, prob_threshold, flags, mouse_controller, feeder, video_writer, model_dict, model_loading_total_time
+def configure(args):
+    global device, cpu_extension, prob_threshold, flags, num_requests, max_faces, top_k, nms_threshold, detection_interval, smooth, motion_threshold, render_interval, target_fps, image_batch, model_cache_dir, headless
+    from model import use_runtime
+
+    device = args.device
+    cpu_extension = args.cpu_extension
+    prob_threshold = args.prob_threshold
+    flags = args.flags
+    num_requests = max(1, args.num_requests)
+    max_faces = max(1, args.max_faces)
+    top_k = args.top_k
+    nms_threshold = args.nms_threshold
+    detection_interval = max(1, args.detection_interval)
+    smooth = args.smooth
+    motion_threshold = args.motion_threshold
+    render_interval = max(1, args.render_interval)
+    target_fps = args.target_fps
+    image_batch = max(1, args.image_batch)
+    use_runtime(args.runtime, args.stub_latency_scale)
+    model_cache_dir = (
+        model_path_generator(args.model_cache)
+        if not args.no_model_cache and args.runtime == "openvino"
+        else None
+    )
+    headless = args.headless
+
+
+def stage_cache_keys(args):
+    """
+    Returns the {stage: key} stage cache keys of the input and models.
+    """
+    from stage_cache import file_digest, stage_key
+
+    def model_key(arg):
+        model = model_path_generator(arg)
+        return arg, file_digest([model + ".xml", model + ".bin", model + ".onnx"])
+
+    source = (file_digest([input_path]), feeder.skip_policy, feeder.skip)
+    runtime = (args.runtime, device, cpu_extension)
+    face_models = [
+        model_key(args.facial_landmarks_detection_model),
+        model_key(args.head_pose_estimation_model),
+        model_key(args.gaze_estimation_model),
+    ]
+    return {
+        "detection": stage_key(
+            source,
+            runtime,
+            model_key(args.face_detection_model),
+            prob_threshold,
+            top_k,
+            nms_threshold,
+            detection_interval,
+        ),
+        "landmarks": stage_key(source, runtime, face_models[0]),
+        "head_pose": stage_key(source, runtime, face_models[1]),
+        "gaze": stage_key(source, runtime, *face_models),
+    }
+
+
+def open_stage_cache(args):
+    """
+    Returns the StageCache of the run, or None when the results of the input
+    are not reproducible.
+    """
+    from stage_cache import StageCache
+
+    if not args.stage_cache:
+        return None
+    if feeder.input_type not in ("video", "replay") or feeder.skip_policy == "latest":
+        logging.info("The stage cache only applies to videos without latest policy")
+        return None
+    if target_fps > 0:
+        logging.info("The stage cache is disabled with --target_fps")
+        return None
+    cache = StageCache(
+        output_path_generator(args.stage_cache), args.stage_cache_size << 20
+    )
+    cache.open(stage_cache_keys(args))
+    return cache
+
+
+def open_recording(args):
+    """
+    Returns the FrameStoreWriter of --record, or None.
+    """
+    from frame_store import FRAME_STORE_EXTENSION, FrameStoreWriter, is_frame_store
+
+    if not args.record:
+        return None
+    path = input_path_generator(args.record)
+    if not is_frame_store(path):
+        path += FRAME_STORE_EXTENSION
+    size = None
+    if args.record_resize:
+        _, _, height, width = model_dict["Model_FaceDetection"].input_shape
+        size = (width, height)
+    return FrameStoreWriter(path, size=size)
+
+
+def open_input(args, input_file, output_name):
+    global input_path, output_path, recorder, results_writer, mouse_controller, feeder, video_encoder, stage_cache, publisher
+    from frame_store import is_frame_store
+    from input_feeder import InputFeeder, is_image_input
+    from instrumentation import SpanRecorder
+    from video_encoder import VideoEncoder
+
+    input_path = input_path_generator(input_file) if input_file != "CAM" else None
+    output_path = output_path_generator(output_name)
+    recorder = SpanRecorder(enabled=args.profile)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    if not headless:
+        from mouse_controller import MouseController
+
+        mouse_controller = MouseController("low", "fast")
+    if input_path:
+        skip_policy = args.skip_policy or "nth"
+        if is_frame_store(input_path):
+            feeder = InputFeeder(
+                "replay",
+                input_path,
+                skip_policy,
+                args.frame_skip,
+                recorder=recorder,
+                replay_speed=args.replay_speed,
+            )
+        elif is_image_input(input_path):
+            if args.record:
+                logging.warning("Image inputs are not recorded")
+            feeder = InputFeeder(
+                "image",
+                input_path,
+                "all",
+                recorder=recorder,
+                workers=args.decode_workers,
+            )
+        else:
+            feeder = InputFeeder(
+                "video",
+                input_path,
+                skip_policy,
+                args.frame_skip,
+                recorder=recorder,
+                record=open_recording(args),
+            )
+    else:
+        skip_policy = args.skip_policy or "latest"
+        feeder = InputFeeder(
+            "cam",
+            None,
+            skip_policy,
+            args.frame_skip,
+            recorder=recorder,
+            record=open_recording(args),
+        )
+    try:
+        feeder.load_data()
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not open the input {input_path} ~ {e}")
+        sys.exit(1)
+    initial_w, initial_h, video_len = feeder.frame_initials_and_length()
+    image_input = feeder.input_type == "image"
+    if image_input and not video_len:
+        logging.error(f"No images found at {input_path}")
+        sys.exit(1)
+    if headless:
+        from results_writer import ImageResultsWriter, ResultsWriter
+    if headless and image_input:
+        results_writer = ImageResultsWriter(
+            os.path.join(output_path, "results"), feeder.paths, args.results_format
+        )
+    elif headless:
+        results_writer = ResultsWriter(
+            os.path.join(output_path, "results"), args.results_format
+        )
+    # Images may differ in size, so they are not encoded into a video.
+    metadata_only = (
+        args.metadata_only or image_input or (headless and not args.headless_video)
+    )
+    video_encoder = VideoEncoder(
+        os.path.join(output_path, "output_video"),
+        processing_rate() / render_interval,
+        (initial_w, initial_h),
+        args.video_codec,
+        args.encoder_queue,
+        metadata_only,
+        args.hw_encode,
+        recorder,
+        render_interval,
+    )
+    stage_cache = open_stage_cache(args)
+    publisher = None
+    if args.publish_shm or args.publish_socket:
+        from gaze_publisher import GazePublisher
+
+        publisher = GazePublisher(
+            args.publish_shm, args.publish_socket, args.publish_capacity
+        )
+
+
+def precision_of(model):
+    """
+    Returns the precision of a model path, None if it has no precision directory.
+    """
+    for precision, precision_dir in PRECISION_DIRS.items():
+        if precision_dir in model.split("/"):
+            return precision
+    return None
+
+
+def with_precision(model, precision):
+    """
+    Returns the model path with its precision directory replaced.
+    """
+    return "/".join(
+        PRECISION_DIRS[precision] if part in PRECISION_DIRS.values() else part
+        for part in model.split("/")
+    )
+
+
+def load_models(args):
+    global model_dict, precision_models, model_loading_total_time
     model_args = [
         args.face_detection_model,
         args.facial_landmarks_detection_model,
         args.head_pose_estimation_model,
         args.gaze_estimation_model,
     ]
+    from face_detection import Model_FaceDetection
+    from facial_landmarks_detection import Model_FacialLandMarkDetection
+    from gaze_estimation import Model_GazeEstimation
+    from head_pose_estimation import Model_HeadPoseEstimation
+
     model_class = [
         Model_FaceDetection,
         Model_FacialLandMarkDetection,
         Model_HeadPoseEstimation,
         Model_GazeEstimation,
     ]
-    input_path = input_path_generator(args.input) if args.input != "CAM" else None
-    output_path = output_path_generator(args.output)
-    device = args.device
-    cpu_extension = args.cpu_extension
-    prob_threshold = args.prob_threshold
-    flags = args.flags
-    if not os.path.exists(output_path):
-        os.mkdir(output_path)
-    mouse_controller = MouseController("low", "fast")
-    if input_path:
-        if input_path.endswith(".jpg"):
-            feeder = InputFeeder("image", input_path)
-        else:
-            feeder = InputFeeder("video", input_path)
-    else:
-        feeder = InputFeeder("cam")
-    feeder.load_data()
-    fps = feeder.fps()
-    initial_w, initial_h, video_len = feeder.frame_initials_and_length()
-    video_writer = cv2.VideoWriter(
-        os.path.join(output_path, "output_video.mp4"),
-        cv2.VideoWriter_fourcc(*"avc1"),
-        fps / 10,
-        (initial_w, initial_h),
-        True,
-    )
     model_dict, model_loading_total_time = generate_model_dict(model_args, model_class)
-    return
 
+    # The downstream models of the other precisions are loaded up front so the
+    # quality controller can switch between them without a pause.
+    launch_precision = precision_of(args.gaze_estimation_model) or "launch"
+    precision_models = {launch_precision: model_dict}
+    for precision in args.precisions if target_fps > 0 else []:
+        if precision in precision_models:
+            continue
+        if precision_of(args.gaze_estimation_model) is None:
+            logging.error(f"Cannot derive the {precision} model paths")
+            sys.exit(1)
+        logging.info(f"*********** Loading {precision} models ***********")
+        models, loading_time = generate_model_dict(
+            [with_precision(arg, precision) for arg in model_args[1:]],
+            model_class[1:],
+        )
+        precision_models[precision] = models
+        model_loading_total_time += loading_time
 
-def inference():
-    inference_start_time = time.time()
-    count = 0
-    face_detection_infer_total = 0
-    facial_landmark_detection_infer_total = 0
-    headpose_estimation_infer_total = 0
-    gaze_estimation_infer_total = 0
 
-    face_detection = model_dict["Model_FaceDetection"]
-    facial_landmark_detection = model_dict["Model_FacialLandMarkDetection"]
-    headpose_estimation = model_dict["Model_HeadPoseEstimation"]
-    gaze_estimation = model_dict["Model_GazeEstimation"]
+def setup(args):
+    import_stages(args)
+    configure(args)
+    # The models are loaded first, the frames of a camera do not pile up
+    # meanwhile and --record_resize needs the face detector input size.
+    load_models(args)
+    open_input(args, args.input, args.output)
+
 
-    while True:
-        try:
-            flag, frame = next(feeder.next_batch())
-        except StopIteration:
-            break
+def frames():
+    for flag, frame in feeder.next_batch():
         if not flag:
             break
-        key_pressed = cv2.waitKey(60)
-
-        start_time = time.time()
-        b_boxes, output_frame = face_detection.predict(frame, flags, prob_threshold)
-        face_detection_infer_total += time.time() - start_time
-
-        for b_box in b_boxes:
-            cropped_face = frame[b_box[1] : b_box[3], b_box[0] : b_box[2]]
-
-            start_time = time.time()
-            (
-                left_eye_coord,
-                right_eye_coord,
-                output_frame,
-            ) = facial_landmark_detection.predict(
-                cropped_face, flags, prob_threshold, b_box, output_frame
-            )
-            facial_landmark_detection_infer_total += time.time() - start_time
+        yield frame
+
+
+def image_results(engine):
+    """
+    Yields a FrameResult per readable image of an image input. The images go
+    through engine.run_batch image_batch at a time, the frame_id of an image
+    is its index in feeder.paths.
+    """
+    from engine import FrameResult
+
+    batch = []
+    for frame_id, (_, image) in enumerate(feeder.next_images()):
+        if image is not None:
+            batch.append((frame_id, image))
+        if len(batch) == image_batch or frame_id == len(feeder.paths) - 1:
+            faces = engine.run_batch([image for _, image in batch]) if batch else []
+            for (batch_frame_id, batch_image), image_faces in zip(batch, faces):
+                yield FrameResult(batch_frame_id, batch_image, image_faces)
+            batch = []
+
+
+def processing_rate():
+    """
+    Returns the number of processed frames per second of input.
+    """
+    rate = feeder.fps() or 30
+    if feeder.skip_policy == "nth":
+        rate /= feeder.skip
+    return rate
+
+
+def quality_controller(engine, tracker):
+    """
+    Returns a QualityController over the knobs that apply to this run.
+    """
+    from engine import STAGES
+    from quality import Knob, QualityController
+
+    def set_precision(precision):
+        engine.use_models(precision_models[precision])
+
+    def set_detection_interval(interval):
+        tracker.detection_interval = interval
+
+    def set_face_limit(limit):
+        engine.face_limit = limit
 
-            start_time = time.time()
-            angle_list, output_frame = headpose_estimation.predict(
-                cropped_face, flags, prob_threshold, output_frame
+    def set_frame_skip(skip):
+        feeder.skip = skip
+
+    downstream = STAGES[1:]
+    knobs = []
+    if len(precision_models) > 1:
+        knobs.append(
+            Knob("precision", list(precision_models), set_precision, downstream)
+        )
+    knobs.append(
+        Knob(
+            "detection_interval",
+            [detection_interval << i for i in range(4)],
+            set_detection_interval,
+            ["Model_FaceDetection", "FaceTracker"],
+        )
+    )
+    knobs.append(Knob("face_limit", [None, 1], set_face_limit, downstream))
+    if feeder.skip_policy == "nth":
+        knobs.append(
+            Knob(
+                "frame_skip",
+                [feeder.skip << i for i in range(3)],
+                set_frame_skip,
             )
-            headpose_estimation_infer_total += time.time() - start_time
-
-            start_time = time.time()
-            gaze_vector, output_frame = gaze_estimation.predict(
-                output_frame,
-                flags,
-                b_box,
-                cropped_face,
-                left_eye_coord,
-                right_eye_coord,
-                angle_list,
+        )
+    return QualityController(target_fps, knobs)
+
+
+def inference():
+    import cv2
+    from engine import PipelineEngine
+    from instrumentation import PERCENTILES
+    from renderer import Renderer
+
+    inference_start_time = time.time()
+    count = 0
+
+    tracker = None
+    if detection_interval > 1 or target_fps > 0:
+        from tracker import FaceTracker
+
+        tracker = FaceTracker(detection_interval)
+    smoother = None
+    if smooth or motion_threshold > 0:
+        from smoothing import FaceSmoother
+
+        smoother = FaceSmoother(
+            processing_rate(), smoothing=smooth, motion_threshold=motion_threshold
+        )
+    engine = PipelineEngine(
+        model_dict,
+        prob_threshold,
+        num_requests,
+        tracker,
+        recorder,
+        smoother,
+        stage_cache,
+    )
+    controller = quality_controller(engine, tracker) if target_fps > 0 else None
+    renderer = Renderer(flags, render_interval, recorder)
+    # Overlays are only drawn when the frame is displayed or encoded.
+    rendering = not headless or not video_encoder.metadata_only
+    if feeder.input_type == "image":
+        results = image_results(engine)
+    else:
+        results = engine.run(frames())
+    for result in results:
+        if "total" not in startup_times:
+            # Only the first run of the process is a cold start.
+            startup_times["first_inference"] = time.time() - inference_start_time
+            startup_times["total"] = time.time() - startup_start_time
+            log_startup_times()
+        if publisher is not None:
+            with recorder.span(result.frame_id, "publish", "GazePublisher"):
+                publisher.publish(result)
+        if controller is not None:
+            controller.update(
+                feeder.skip if feeder.skip_policy == "nth" else 1,
+                engine.stage_totals,
             )
-            gaze_estimation_infer_total += time.time() - start_time
+        due = renderer.due(result.frame_id)
+        if due:
+            output_frame = renderer.render(result) if rendering else result.frame
+            video_encoder.write(result.frame_id, output_frame)
+        if headless:
+            results_writer.add(result)
+            count += 1
+            continue
 
-            cv2.imshow("Computer Pointer Control", output_frame)
-            video_writer.write(output_frame)
-            mouse_controller.move(gaze_vector[0], gaze_vector[1])
+        with recorder.span(result.frame_id, "draw", "display"):
+            if due:
+                cv2.imshow("Computer Pointer Control", output_frame)
+            key_pressed = cv2.waitKey(60)
+        for face in result.faces:
+            with recorder.span(result.frame_id, "actuate", "mouse_controller"):
+                mouse_controller.move(face.gaze_vector[0], face.gaze_vector[1])
 
         count += 1
         if key_pressed == 27:
+            results.close()
             break
 
+    engine.close()
+    video_encoder.close()
+    if stage_cache is not None:
+        stage_cache.close()
+    if publisher is not None:
+        publisher.close()
+    if headless:
+        results_writer.close()
+    else:
+        mouse_controller.close()
     model_inference_total_time = time.time() - inference_start_time
-    fps = count / round(model_inference_total_time, 1)
+    fps = count / model_inference_total_time if model_inference_total_time else 0
 
     if count > 0:
         logging.info("*********** Model Inference Time Start ****************")
-        logging.info(
-            f"Model_FaceDetection: {1000*face_detection_infer_total/count:.1f} ms."
-        )
-        logging.info(
-            f"Model_FacialLandMarkDetection: {1000*facial_landmark_detection_infer_total/count:.1f} ms."
-        )
-        logging.info(
-            f"Model_HeadPoseEstimation: {1000*headpose_estimation_infer_total/count:.1f} ms."
-        )
-        logging.info(
-            f"Model_GazeEstimation: {1000*gaze_estimation_infer_total/count:.1f} ms."
-        )
+        for stage, stage_total in engine.stage_totals.items():
+            logging.info(f"{stage}: {1000 * stage_total / count:.1f} ms.")
+        if smoother is not None and smoother.motion_threshold > 0:
+            logging.info(f"Reused face results: {smoother.reused_faces}")
+        if stage_cache is not None:
+            for stage, hits in stage_cache.hits.items():
+                logging.info(
+                    f"Stage cache {stage}: {hits} hits, "
+                    f"{stage_cache.misses[stage]} misses"
+                )
+        if publisher is not None:
+            logging.info(
+                f"Published face records: {publisher.published}, "
+                f"socket frames dropped: {publisher.dropped}"
+            )
+        if controller is not None:
+            logging.info(
+                f"Quality switches: {controller.switches}, "
+                f"final settings: {controller.settings()}"
+            )
         logging.info("*********** Model Inference Time End ***********")
 
+    if recorder.enabled:
+        logging.info("*********** Stage Latency Percentiles Start ***********")
+        for stage, stats in recorder.summary().items():
+            percentiles = " ".join(
+                f"p{percentile}: {stats[f'p{percentile}_ms']:.1f}"
+                for percentile in PERCENTILES
+            )
+            logging.info(f"{stage}: {percentiles} ms ({stats['count']} spans).")
+        logging.info("*********** Stage Latency Percentiles End ***********")
+        recorder.export_json(os.path.join(output_path, "latency.json"))
+        recorder.export_csv(os.path.join(output_path, "latency.csv"))
+
     logging.info("*********** Summary ****************")
     logging.info(f"model_loading_total_time: {model_loading_total_time} s.")
     logging.info(f"model_inference_total_time: {model_inference_total_time} s.")
@@ -278,11 +1041,23 @@ def inference():
         f.write(str(fps) + "\n")
 
     feeder.close()
-    cv2.destroyAllWindows()
+    if not headless:
+        cv2.destroyAllWindows()
+
+    return {
+        "frames": count,
+        "model_loading_total_time": model_loading_total_time,
+        "model_inference_total_time": model_inference_total_time,
+        "fps": fps,
+        "stage_totals": dict(engine.stage_totals),
+        "startup_times": dict(startup_times),
+    }
 
 
 def pipeline():
     args = build_argparser().parse_args()
+    setup_logging()
+    check_args(args)
     setup(args)
     inference()
 
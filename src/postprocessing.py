@@ -0,0 +1,116 @@
+"""
+Vectorized post-processing of SSD detection outputs.
+The detection output is a (1, 1, N, 7) blob of [image_id, label, confidence,
+xmin, ymin, xmax, ymax] rows with coordinates relative to the image. Rows are
+thresholded with one boolean mask, scaled to the frame and clipped to it in
+one array operation. Boxes left empty by the clipping are dropped, the rest
+are optionally cut to the top_k most confident detections and suppressed with
+non-maximum suppression. The boxes come back as an (N, 4)
+int32 array of [xmin, ymin, xmax, ymax] pixels, most confident first.
+Sample usage:
+    b_boxes = detection_boxes(outputs, width, height, threshold=0.5, top_k=4)
+    for xmin, ymin, xmax, ymax in b_boxes:
+        do_something(frame[ymin:ymax, xmin:xmax])
+"""
+import numpy as np
+
+
+def threshold_detections(outputs, threshold):
+    """
+    Returns the confidences and relative [xmin, ymin, xmax, ymax] coordinates
+    of the detections with a confidence of at least threshold. Rows from the
+    image_id -1 end marker of the SSD output on are ignored.
+    """
+    rows = np.asarray(outputs).reshape(-1, 7)
+    end = np.flatnonzero(rows[:, 0] < 0)
+    if len(end):
+        rows = rows[: end[0]]
+    mask = rows[:, 2] >= threshold
+    return rows[mask, 2], rows[mask, 3:7]
+
+
+def scale_boxes(coords, width, height):
+    """
+    Scales relative coordinates to pixels of a width x height frame, clipped
+    to the frame.
+    """
+    scale = np.array([width, height, width, height], dtype=np.float32)
+    boxes = np.asarray(coords, dtype=np.float32) * scale
+    np.clip(boxes, 0, scale, out=boxes)
+    return boxes.astype(np.int32)
+
+
+def nonempty_boxes(boxes):
+    """
+    Returns the mask of the boxes with a positive width and height.
+    """
+    return (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+
+
+def sort_by_score(scores, boxes, k=None):
+    """
+    Returns the detections sorted by confidence, cut to the k most confident
+    ones when k is given.
+    """
+    order = np.argsort(-scores, kind="stable")
+    if k is not None:
+        order = order[:k]
+    return scores[order], boxes[order]
+
+
+def box_ious(box, boxes):
+    """
+    Returns the IoU of box with every row of boxes.
+    """
+    x_min = np.maximum(box[0], boxes[:, 0])
+    y_min = np.maximum(box[1], boxes[:, 1])
+    x_max = np.minimum(box[2], boxes[:, 2])
+    y_max = np.minimum(box[3], boxes[:, 3])
+    intersection = np.maximum(0, x_max - x_min) * np.maximum(0, y_max - y_min)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - intersection
+    return np.divide(
+        intersection,
+        union,
+        out=np.zeros(len(boxes), dtype=np.float64),
+        where=union > 0,
+    )
+
+
+def nms(boxes, iou_threshold):
+    """
+    Greedy non-maximum suppression over boxes sorted by confidence. Returns
+    the indexes of the kept boxes. Every step suppresses all the boxes that
+    overlap the kept one at once.
+    """
+    boxes = boxes.astype(np.float64)
+    remaining = np.arange(len(boxes))
+    keep = []
+    while len(remaining):
+        index = remaining[0]
+        keep.append(index)
+        overlaps = box_ious(boxes[index], boxes[remaining[1:]])
+        remaining = remaining[1:][overlaps <= iou_threshold]
+    return np.array(keep, dtype=np.intp)
+
+
+def detection_boxes(
+    outputs, width, height, threshold=0.5, top_k=None, iou_threshold=None
+):
+    """
+    Returns the (N, 4) int32 pixel boxes of the detections in outputs. top_k
+    limits the number of boxes and iou_threshold enables non-maximum
+    suppression, which runs first so suppressed boxes do not count.
+    """
+    scores, coords = threshold_detections(outputs, threshold)
+    boxes = scale_boxes(coords, width, height)
+    # Detections outside the frame are empty once clipped, they would crop
+    # nothing and take the place of real faces in top_k.
+    mask = nonempty_boxes(boxes)
+    scores, boxes = scores[mask], boxes[mask]
+    if iou_threshold is None:
+        return sort_by_score(scores, boxes, top_k)[1]
+    scores, boxes = sort_by_score(scores, boxes)
+    boxes = boxes[nms(boxes, iou_threshold)]
+    return boxes[:top_k]
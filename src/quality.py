@@ -0,0 +1,170 @@
+"""
+Adaptive quality controller that holds a target frame rate.
+The controller watches how many input frames per second the pipeline keeps
+up with and how the per-stage time is split, and trades accuracy for speed
+through knobs, each an ordered list of settings from best to cheapest:
+    precision           preloaded lower precisions of the downstream models
+    detection_interval  run the face detector less often, track in between
+    face_limit          process only the most confident faces
+    frame_skip          process fewer of the input frames
+When the measured rate falls below target_fps, the knob relieving the stages
+that take the largest share of the time is stepped down; knobs without
+stages (frame_skip) are only used when nothing else is left. When the rate
+is above target_fps * (1 + headroom) the last change is undone. A step back
+up that does not hold doubles the number of windows with headroom needed
+before the next attempt, so the controller does not oscillate between two
+settings. A step down that does not raise the rate is undone and that
+setting is not tried again. Every decision waits for a full window measured
+at the current settings.
+Sample usage:
+    controller = QualityController(
+        25, [Knob("face_limit", [None, 1], set_face_limit, STAGES[1:])]
+    )
+    for result in results:
+        controller.update(input_frames, engine.stage_totals)
+"""
+import logging
+import time
+from collections import deque
+
+
+class Knob:
+    def __init__(self, name, values, apply, stages=None):
+        """
+        name: str, Name used in the log.
+        values: list, Settings from the best to the cheapest one, the first
+                one is in effect at the start.
+        apply: callable, Called with the new setting.
+        stages: list, Stage names whose time the knob reduces, None for all.
+        """
+        self.name = name
+        self.values = values
+        self.apply = apply
+        self.stages = stages
+        self.index = 0
+        self.limit = len(values) - 1
+
+    @property
+    def value(self):
+        return self.values[self.index]
+
+    def can_step(self, step):
+        return 0 <= self.index + step <= self.limit
+
+    def step(self, step):
+        self.index += step
+        self.apply(self.value)
+
+
+class QualityController:
+    def __init__(self, target_fps, knobs, window=30, headroom=0.2):
+        """
+        target_fps: float, Input frames per second the pipeline should keep up with.
+        knobs: list, Knobs in the order they are preferred on equal shares.
+        window: int, Processed frames measured before every decision.
+        headroom: float, Relative margin above target_fps needed to step back up.
+        """
+        self.target_fps = target_fps
+        self.knobs = knobs
+        self.window = max(2, window)
+        self.headroom = headroom
+        self.samples = deque(maxlen=self.window)
+        self.changes = []
+        self.backoff = 1
+        self.windows_above = 0
+        self.stepped_up = False
+        self.stepped_down = None
+        self.switches = 0
+
+    def fps(self):
+        """
+        Returns the input frames per second covered over the window.
+        """
+        elapsed = self.samples[-1][0] - self.samples[0][0]
+        frames = sum(input_frames for _, input_frames, _ in list(self.samples)[1:])
+        return frames / elapsed if elapsed > 0 else float("inf")
+
+    def stage_shares(self):
+        """
+        Returns the share of every stage in the stage time of the window.
+        """
+        first, last = self.samples[0][2], self.samples[-1][2]
+        durations = {stage: last[stage] - first.get(stage, 0.0) for stage in last}
+        total = sum(durations.values())
+        if total <= 0:
+            return {}
+        return {stage: duration / total for stage, duration in durations.items()}
+
+    def choose(self):
+        """
+        Returns the knob to step down, or None when all are exhausted.
+        """
+        shares = self.stage_shares()
+        candidates = [
+            knob for knob in self.knobs if knob.stages is not None and knob.can_step(1)
+        ]
+        if candidates:
+            return max(
+                candidates,
+                key=lambda knob: sum(shares.get(stage, 0.0) for stage in knob.stages),
+            )
+        for knob in self.knobs:
+            if knob.stages is None and knob.can_step(1):
+                return knob
+        return None
+
+    def update(self, input_frames, stage_totals):
+        """
+        Records a processed frame that covered input_frames input frames, with
+        the cumulative stage_totals of the engine, and steps a knob when the
+        window is full. Returns the knob that was stepped, if any.
+        """
+        self.samples.append((time.perf_counter(), input_frames, dict(stage_totals)))
+        if len(self.samples) < self.window:
+            return None
+        fps = self.fps()
+        knob = None
+        if self.stepped_down is not None:
+            knob, fps_before = self.stepped_down
+            self.stepped_down = None
+            if fps <= fps_before:
+                # The cheaper setting did not help, e.g. tracking costs more
+                # than detecting on this machine, so it is not tried again.
+                self.changes.pop()
+                knob.step(-1)
+                knob.limit = knob.index
+                return self.switched(knob, fps)
+            knob = None
+        if self.stepped_up:
+            # The first window after a step up tells whether it held.
+            self.backoff = 1 if fps >= self.target_fps else 2 * self.backoff
+            self.stepped_up = False
+        if fps < self.target_fps:
+            self.windows_above = 0
+            knob = self.choose()
+            if knob is not None:
+                knob.step(1)
+                self.changes.append(knob)
+                self.stepped_down = (knob, fps)
+        elif fps > self.target_fps * (1 + self.headroom) and self.changes:
+            self.windows_above += 1
+            if self.windows_above >= self.backoff:
+                self.windows_above = 0
+                knob = self.changes.pop()
+                knob.step(-1)
+                self.stepped_up = True
+        else:
+            self.windows_above = 0
+        if knob is None:
+            self.samples.clear()
+            return None
+        return self.switched(knob, fps)
+
+    def switched(self, knob, fps):
+        self.samples.clear()
+        self.switches += 1
+        logging.info(f"{fps:.1f} FPS, {knob.name} set to {knob.value}")
+        return knob
+
+    def settings(self):
+        return {knob.name: knob.value for knob in self.knobs}
@@ -0,0 +1,91 @@
+"""
+Overlay rendering, decoupled from inference.
+The models only return results; the Renderer draws the overlays selected by
+the -f flags onto the frame of a FrameResult, all faces in one pass:
+    fdm   face boxes
+    fldm  circles around the eyes
+    hpem  yaw, pitch and roll of the head pose
+    gem   gaze vector and an arrow from each eye
+Rendering is only worth its cost when a frame is displayed or encoded, and
+with interval n only every nth processed frame is rendered at all.
+Sample usage:
+    renderer = Renderer(["fdm", "gem"], interval=2)
+    for result in engine.run(frames):
+        if renderer.due(result.frame_id):
+            show(renderer.render(result))
+"""
+import cv2
+from instrumentation import NULL_RECORDER
+
+BOX_COLOR = (0, 0, 255)
+TEXT_COLOR = (255, 255, 0)
+
+
+class Renderer:
+    def __init__(self, flags, interval=1, recorder=NULL_RECORDER):
+        """
+        flags: list, Overlays to draw, any of fdm fldm hpem gem.
+        interval: int, Render every interval-th processed frame.
+        recorder: SpanRecorder, Receives a draw span per rendered frame.
+        """
+        self.flags = set(flags or [])
+        self.interval = max(1, interval)
+        self.recorder = recorder
+
+    def due(self, frame_id):
+        return frame_id % self.interval == 0
+
+    def render(self, result):
+        """
+        Draws the overlays of all the faces of the result onto its frame and
+        returns the frame.
+        """
+        frame = result.frame
+        if not self.flags:
+            return frame
+        with self.recorder.span(result.frame_id, "draw", "Renderer"):
+            for face in result.faces:
+                if "fdm" in self.flags:
+                    self.draw_box(frame, face)
+                if "fldm" in self.flags:
+                    self.draw_landmarks(frame, face)
+                if "hpem" in self.flags:
+                    self.draw_head_pose(frame, face)
+                if "gem" in self.flags:
+                    self.draw_gaze(frame, face)
+        return frame
+
+    def draw_box(self, frame, face):
+        xmin, ymin, xmax, ymax = [int(value) for value in face.b_box]
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), BOX_COLOR, 2)
+
+    def draw_landmarks(self, frame, face):
+        xmin, ymin = int(face.b_box[0]), int(face.b_box[1])
+        for eye_x, eye_y in [face.left_eye_coord, face.right_eye_coord]:
+            cv2.circle(frame, (xmin + int(eye_x), ymin + int(eye_y)), 30, BOX_COLOR, 2)
+
+    def draw_head_pose(self, frame, face):
+        yaw, pitch, roll = face.angle_list
+        cv2.putText(frame, f"yaw:{yaw:.1f}", (20, 20), 0, 0.6, TEXT_COLOR)
+        cv2.putText(frame, f"pitch:{pitch:.1f}", (20, 40), 0, 0.6, TEXT_COLOR)
+        cv2.putText(frame, f"roll:{roll:.1f}", (20, 60), 0, 0.6, TEXT_COLOR)
+
+    def draw_gaze(self, frame, face):
+        gaze_vector_x, gaze_vector_y, gaze_vector_z = face.gaze_vector
+        cv2.putText(frame, f"X:{gaze_vector_x*100:.1f}", (20, 100), 0, 0.7, TEXT_COLOR)
+        cv2.putText(frame, f"Y:{gaze_vector_y*100:.1f}", (20, 120), 0, 0.7, TEXT_COLOR)
+        cv2.putText(frame, f"Z:{gaze_vector_z:.1f}", (20, 140), 0, 0.7, TEXT_COLOR)
+        xmin, ymin = face.b_box[0], face.b_box[1]
+        for eye_x, eye_y in [face.left_eye_coord, face.right_eye_coord]:
+            center_x = int(xmin + eye_x)
+            center_y = int(ymin + eye_y)
+            cv2.arrowedLine(
+                frame,
+                (center_x, center_y),
+                (
+                    center_x + int(gaze_vector_x * 100),
+                    center_y + int(-gaze_vector_y * 100),
+                ),
+                TEXT_COLOR,
+                3,
+            )
@@ -0,0 +1,120 @@
+"""
+Columnar writer for the per-face results of a run.
+One row is written per detected face and frame. The columns are stored as
+typed arrays, either in a compressed .npz file or in a .csv file with one
+column per value.
+ImageResultsWriter writes one row per image of an image set instead, with the
+image path, its number of faces and the results of its most confident face.
+Sample usage:
+    writer = ResultsWriter(os.path.join(output_path, "results"), "npz")
+    for result in engine.run(frames):
+        writer.add(result)
+    writer.close()
+"""
+import csv
+
+import numpy as np
+
+from options import RESULT_FORMATS
+
+COLUMNS = [
+    ("frame_id", np.int32, 1),
+    ("face_id", np.int32, 1),
+    ("b_box", np.int32, 4),
+    ("left_eye_coord", np.float32, 2),
+    ("right_eye_coord", np.float32, 2),
+    ("angle_list", np.float32, 3),
+    ("gaze_vector", np.float32, 3),
+]
+IMAGE_COLUMNS = [("image", str, 1), ("faces", np.int32, 1)] + COLUMNS[2:]
+
+
+class ResultsWriter:
+    column_types = COLUMNS
+
+    def __init__(self, path, results_format="npz"):
+        if results_format not in RESULT_FORMATS:
+            raise ValueError(
+                f"Unknown results format {results_format}, expected one of {RESULT_FORMATS}"
+            )
+        self.path = f"{path}.{results_format}"
+        self.results_format = results_format
+        self.columns = {name: [] for name, _, _ in self.column_types}
+
+    def add(self, result):
+        for face in result.faces:
+            self.columns["frame_id"].append(result.frame_id)
+            self.columns["face_id"].append(face.face_id)
+            self.columns["b_box"].append(face.b_box)
+            self.columns["left_eye_coord"].append(face.left_eye_coord)
+            self.columns["right_eye_coord"].append(face.right_eye_coord)
+            self.columns["angle_list"].append(face.angle_list)
+            self.columns["gaze_vector"].append(face.gaze_vector)
+
+    def arrays(self):
+        arrays = {}
+        for name, dtype, width in self.column_types:
+            shape = (len(self.columns[name]),) if width == 1 else (-1, width)
+            arrays[name] = np.asarray(self.columns[name], dtype=dtype).reshape(shape)
+        return arrays
+
+    def close(self):
+        arrays = self.arrays()
+        if self.results_format == "npz":
+            np.savez_compressed(self.path, **arrays)
+            return
+
+        header = []
+        for name, _, width in self.column_types:
+            header += [name] if width == 1 else [f"{name}_{i}" for i in range(width)]
+        with open(self.path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            columns = [
+                arrays[name].reshape(len(arrays[name]), width)
+                for name, _, width in self.column_types
+            ]
+            for row in zip(*columns):
+                writer.writerow(
+                    [
+                        f"{value:.7g}" if isinstance(value, float) else value
+                        for column in row
+                        for value in column.tolist()
+                    ]
+                )
+
+
+class ImageResultsWriter(ResultsWriter):
+    column_types = IMAGE_COLUMNS
+
+    def __init__(self, path, image_paths, results_format="npz"):
+        """
+        image_paths: list, Path of every image, indexed by frame_id. Images
+                     without a result get faces -1, as they could not be read.
+        """
+        super().__init__(path, results_format)
+        self.image_paths = image_paths
+        self.faces = {}
+
+    def add(self, result):
+        self.faces[result.frame_id] = result.faces
+
+    def close(self):
+        for frame_id, image_path in enumerate(self.image_paths):
+            faces = self.faces.get(frame_id)
+            self.columns["image"].append(image_path)
+            self.columns["faces"].append(-1 if faces is None else len(faces))
+            if faces:
+                face = faces[0]
+                self.columns["b_box"].append(face.b_box)
+                self.columns["left_eye_coord"].append(face.left_eye_coord)
+                self.columns["right_eye_coord"].append(face.right_eye_coord)
+                self.columns["angle_list"].append(face.angle_list)
+                self.columns["gaze_vector"].append(face.gaze_vector)
+            else:
+                self.columns["b_box"].append([-1] * 4)
+                self.columns["left_eye_coord"].append([np.nan] * 2)
+                self.columns["right_eye_coord"].append([np.nan] * 2)
+                self.columns["angle_list"].append([np.nan] * 3)
+                self.columns["gaze_vector"].append([np.nan] * 3)
+        super().close()
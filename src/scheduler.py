@@ -0,0 +1,64 @@
+"""
+Small dependency-graph scheduler for the per-face stages.
+Every stage is a function that takes the shared context dict (the inputs of
+the run plus the results of the stages finished so far) and returns its
+result. A stage is started on the thread pool as soon as all the stages it
+depends on are done, so independent stages run concurrently.
+Sample usage:
+    graph = StageGraph()
+    graph.add_stage("a", stage_a)
+    graph.add_stage("b", stage_b)
+    graph.add_stage("c", stage_c, depends_on=["a", "b"])
+    results, durations = graph.run(frame=frame)
+"""
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class StageGraph:
+    def __init__(self, max_workers=None):
+        self.stages = OrderedDict()
+        self.max_workers = max_workers
+        self.executor = None
+
+    def add_stage(self, name, function, depends_on=()):
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Unknown dependency {dependency} for stage {name}")
+        self.stages[name] = (function, list(depends_on))
+
+    def run(self, **inputs):
+        """
+        Runs every stage once and returns the context dict with all the stage
+        results and a dict with the time in seconds each stage took.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers or len(self.stages)
+            )
+        context = dict(inputs)
+        durations = {}
+        pending = OrderedDict(self.stages)
+        running = {}
+        while pending or running:
+            for name, (function, depends_on) in list(pending.items()):
+                if all(dependency in durations for dependency in depends_on):
+                    del pending[name]
+                    future = self.executor.submit(self.timed, function, context)
+                    running[future] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                context[name], durations[name] = future.result()
+        return context, durations
+
+    def timed(self, function, context):
+        start_time = time.time()
+        result = function(context)
+        return result, time.time() - start_time
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,343 @@
+"""
+Serves many independent streams (cameras, videos and socket clients) from one
+set of loaded models.
+Every stream holds one undelivered frame: cameras replace it with newer frames,
+videos and socket clients wait until it was taken. The scheduler takes at
+most one frame per stream and round, starting at a rotating stream so none is
+favoured, and runs the frames of a round through the engine together: face
+detection overlaps across the frames and the faces of all the streams share
+the landmark, head pose and gaze batches.
+Sources are given as a comma separated -i list. CAM is the default camera and
+CAM<n> camera n; anything else is a video under bin. Their results are written
+to results/<output>/<stream>/results.<format>. Local clients can also connect
+to a Unix domain socket (--socket) and send frames as a FRAME_HEADER (height,
+width) followed by the raw BGR bytes; every frame is answered with one JSON
+line holding its faces. At most round_size streams are served per round.
+Sample usage:
+    python server.py -fdm ... -fldm ... -hpem ... -gem ... -i CAM,CAM1,demo.mp4 -o server
+    python server.py -fdm ... -fldm ... -hpem ... -gem ... -i "" -o server --socket /tmp/gaze.sock
+
+    client = StreamClient("/tmp/gaze.sock")
+    faces = client.infer(frame)
+    client.close()
+"""
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+import pipeline
+from engine import FrameResult, PipelineEngine
+from input_feeder import InputFeeder
+from results_writer import ResultsWriter
+
+FRAME_HEADER = struct.Struct("<II")
+
+streams = []
+streams_lock = threading.Condition()
+accepting = False
+
+
+class Stream:
+    def __init__(self, name, live=True):
+        """
+        name: str, Name of the stream, used for its results directory.
+        live: bool, Whether a new frame replaces an undelivered one. Otherwise
+              put waits until the scheduler took the previous frame.
+        """
+        self.name = name
+        self.live = live
+        self.frame = None
+        self.frame_id = -1
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.finished = False
+
+    def put(self, frame):
+        with streams_lock:
+            while not self.live and self.frame is not None and not self.finished:
+                streams_lock.wait()
+            if self.frame is not None:
+                self.frames_dropped += 1
+            self.frame = frame
+            self.frame_id += 1
+            streams_lock.notify_all()
+
+    def take(self):
+        """
+        Returns (frame_id, frame) of the undelivered frame, the caller holds
+        streams_lock.
+        """
+        frame, self.frame = self.frame, None
+        streams_lock.notify_all()
+        return self.frame_id, frame
+
+    def finish(self):
+        with streams_lock:
+            self.finished = True
+            streams_lock.notify_all()
+
+    def deliver(self, frame_id, faces):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FeederStream(Stream):
+    def __init__(self, name, feeder, writer):
+        super().__init__(name, live=feeder.input_type == "cam")
+        self.feeder = feeder
+        self.writer = writer
+        self.reader = threading.Thread(target=self.read, daemon=True)
+
+    def read(self):
+        for flag, frame in self.feeder.next_batch():
+            if not flag or self.finished:
+                break
+            self.put(frame)
+        self.finish()
+
+    def deliver(self, frame_id, faces):
+        self.writer.add(FrameResult(frame_id, None, faces))
+
+    def close(self):
+        self.feeder.close()
+        self.writer.close()
+
+
+class SocketStream(Stream):
+    def __init__(self, name, connection):
+        super().__init__(name, live=False)
+        self.connection = connection
+
+    def deliver(self, frame_id, faces):
+        message = {
+            "frame_id": frame_id,
+            "faces": [
+                {
+                    name: np.asarray(value).tolist()
+                    for name, value in face._asdict().items()
+                }
+                for face in faces
+            ],
+        }
+        try:
+            self.connection.sendall((json.dumps(message) + "\n").encode())
+        except OSError:
+            self.finish()
+
+
+class StreamHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        stream = SocketStream(f"socket{next(self.server.ids)}", self.request)
+        add_stream(stream)
+        try:
+            while not stream.finished:
+                header = receive(self.request, FRAME_HEADER.size)
+                if header is None:
+                    break
+                height, width = FRAME_HEADER.unpack(header)
+                data = receive(self.request, height * width * 3)
+                if data is None:
+                    break
+                stream.put(np.frombuffer(data, np.uint8).reshape(height, width, 3))
+        finally:
+            stream.finish()
+
+
+class StreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    ids = itertools.count()
+
+
+class StreamClient:
+    """
+    Sends frames to a server started with --socket and returns their faces.
+    """
+
+    def __init__(self, socket_path):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socket_path)
+        self.responses = self.connection.makefile("r")
+
+    def infer(self, frame):
+        height, width = frame.shape[:2]
+        self.connection.sendall(FRAME_HEADER.pack(height, width))
+        self.connection.sendall(np.ascontiguousarray(frame, np.uint8).tobytes())
+        line = self.responses.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return json.loads(line)["faces"]
+
+    def close(self):
+        self.responses.close()
+        self.connection.close()
+
+
+def receive(connection, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return data
+
+
+def add_stream(stream):
+    with streams_lock:
+        streams.append(stream)
+        streams_lock.notify_all()
+
+
+def build_argparser():
+    parser = pipeline.build_argparser()
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help="Path of a Unix domain socket accepting frames from local clients",
+    )
+    parser.add_argument(
+        "-rs",
+        "--round_size",
+        type=int,
+        default=8,
+        help="Maximum number of streams whose frames are processed together "
+        "(8 by default)",
+    )
+    return parser
+
+
+def open_stream(args, source):
+    if source.upper().startswith("CAM"):
+        name = source.lower()
+        feeder = InputFeeder(
+            "cam", source[3:], args.skip_policy or "latest", args.frame_skip
+        )
+    else:
+        name = os.path.splitext(os.path.basename(source))[0]
+        feeder = InputFeeder(
+            "video",
+            pipeline.input_path_generator(source),
+            args.skip_policy or "nth",
+            args.frame_skip,
+        )
+    output_path = os.path.join(pipeline.output_path_generator(args.output), name)
+    os.makedirs(output_path, exist_ok=True)
+    writer = ResultsWriter(os.path.join(output_path, "results"), args.results_format)
+    feeder.load_data()
+    return FeederStream(name, feeder, writer)
+
+
+def next_round(offset, round_size):
+    """
+    Waits for frames and returns [(stream, frame_id, frame)] with at most one
+    frame per stream and round_size frames in total, or None once every
+    stream finished and no more streams can connect. Finished streams are
+    removed and closed.
+    """
+    with streams_lock:
+        while True:
+            finished = [
+                stream for stream in streams if stream.finished and stream.frame is None
+            ]
+            for stream in finished:
+                streams.remove(stream)
+                stream.close()
+                logging.info(
+                    f"{stream.name}: {stream.frames_processed} frames processed, "
+                    f"{stream.frames_dropped} dropped"
+                )
+            start = offset % len(streams) if streams else 0
+            ready = [
+                stream
+                for stream in streams[start:] + streams[:start]
+                if stream.frame is not None
+            ]
+            if ready:
+                return [(stream,) + stream.take() for stream in ready[:round_size]]
+            if not streams and not accepting:
+                return None
+            streams_lock.wait(timeout=0.1)
+
+
+def serve():
+    global accepting
+    args = build_argparser().parse_args()
+    args.headless = True
+    pipeline.setup_logging()
+    pipeline.check_args(args, check_input=False)
+    pipeline.configure(args)
+    pipeline.load_models(args)
+
+    for source in filter(None, args.input.split(",")):
+        add_stream(open_stream(args, source))
+    for stream in list(streams):
+        stream.reader.start()
+    server = None
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = StreamServer(args.socket, StreamHandler)
+        accepting = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Accepting streams on {args.socket}")
+    if not streams and not server:
+        logging.error("No input streams given")
+        sys.exit(1)
+
+    engine = PipelineEngine(
+        pipeline.model_dict, pipeline.prob_threshold, pipeline.num_requests
+    )
+    start_time = time.time()
+    count = 0
+    offset = 0
+    try:
+        while True:
+            round_frames = next_round(offset, max(1, args.round_size))
+            if round_frames is None:
+                break
+            offset += 1
+            results = engine.run_batch([frame for _, _, frame in round_frames])
+            for (stream, frame_id, _), faces in zip(round_frames, results):
+                stream.deliver(frame_id, faces)
+                stream.frames_processed += 1
+            count += len(round_frames)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            accepting = False
+            server.shutdown()
+            server.server_close()
+            os.remove(args.socket)
+        with streams_lock:
+            for stream in streams:
+                stream.finished = True
+                stream.close()
+            streams.clear()
+            streams_lock.notify_all()
+        engine.close()
+
+    total_time = time.time() - start_time
+    logging.info("*********** Summary ****************")
+    logging.info(f"model_loading_total_time: {pipeline.model_loading_total_time} s.")
+    logging.info(f"frames: {count}")
+    logging.info(f"FPS: {count / total_time if total_time else 0}")
+    logging.info("*********** Summary End ***********")
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,180 @@
+"""
+Temporal smoothing of the per-face results and motion gating of inference.
+The head pose angles and gaze vectors of every face are filtered with a
+One-Euro filter: a low-pass filter whose cutoff frequency rises with the
+speed of the signal, so a still user gets a steady pointer while fast
+movements are followed without lag.
+The motion gate compares a small grayscale thumbnail of each face crop with
+the thumbnail of the last crop that went through the models. While the mean
+absolute difference stays below motion_threshold (0..1 of the pixel range)
+the last landmarks, head pose and gaze are reused instead of running the
+landmark, head pose and gaze models again. A face is inferred again after
+max_reuse reused frames at the latest.
+Faces are identified by their face_id, so the state follows a face across
+frames; it is dropped once a face was not seen for max_age frames.
+Sample usage:
+    smoother = FaceSmoother(rate=30, motion_threshold=0.02)
+    if smoother.moved(frame_id, face_id, cropped_face):
+        face = infer(cropped_face)
+        face = smoother.update(frame_id, face, inferred=True)
+    else:
+        face = smoother.update(frame_id, smoother.last(face_id), inferred=False)
+"""
+import math
+
+import numpy as np
+
+import cv2
+
+THUMBNAIL_SIZE = (32, 32)
+
+
+def smoothing_factor(dt, cutoff):
+    r = 2 * math.pi * cutoff * dt
+    return r / (r + 1)
+
+
+class OneEuroFilter:
+    def __init__(self, min_cutoff=1.0, beta=0.007, d_cutoff=1.0):
+        """
+        min_cutoff: float, Cutoff frequency in Hz of a still signal, lower is smoother.
+        beta: float, How fast the cutoff frequency rises with the speed of the
+              signal, higher follows fast movements with less lag.
+        d_cutoff: float, Cutoff frequency in Hz of the speed estimate.
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.t = None
+        self.x = None
+        self.dx = None
+
+    def __call__(self, t, x):
+        """
+        Filters the value x (scalar or array) taken at time t in seconds.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if self.t is None:
+            self.t, self.x, self.dx = t, x, np.zeros_like(x)
+            return x
+        dt = t - self.t
+        if dt <= 0:
+            return self.x
+        a_d = smoothing_factor(dt, self.d_cutoff)
+        self.dx = a_d * (x - self.x) / dt + (1 - a_d) * self.dx
+        cutoff = self.min_cutoff + self.beta * np.abs(self.dx)
+        a = smoothing_factor(dt, cutoff)
+        self.x = a * x + (1 - a) * self.x
+        self.t = t
+        return self.x
+
+
+class FaceState:
+    def __init__(self, smoothing, min_cutoff, angle_beta, gaze_beta):
+        self.reference = None
+        self.pending = None
+        self.face = None
+        self.reused = 0
+        self.last_seen = None
+        self.angle_filter = OneEuroFilter(min_cutoff, angle_beta) if smoothing else None
+        self.gaze_filter = OneEuroFilter(min_cutoff, gaze_beta) if smoothing else None
+
+
+class FaceSmoother:
+    def __init__(
+        self,
+        rate=30,
+        smoothing=True,
+        min_cutoff=1.0,
+        angle_beta=0.05,
+        gaze_beta=2.0,
+        motion_threshold=0.0,
+        max_reuse=30,
+        max_age=30,
+    ):
+        """
+        rate: float, Processed frames per second, turns frame ids into time.
+        smoothing: bool, Whether the angles and gaze vectors are filtered.
+        min_cutoff, angle_beta, gaze_beta: float, One-Euro filter parameters
+              of the head pose angles (degrees) and gaze vectors.
+        motion_threshold: float, Mean absolute thumbnail difference below which
+              a face counts as still, 0 disables the motion gate.
+        max_reuse: int, Maximum number of frames a result is reused.
+        max_age: int, Frames after which the state of an unseen face is dropped.
+        """
+        self.rate = rate
+        self.smoothing = smoothing
+        self.min_cutoff = min_cutoff
+        self.angle_beta = angle_beta
+        self.gaze_beta = gaze_beta
+        self.motion_threshold = motion_threshold
+        self.max_reuse = max_reuse
+        self.max_age = max_age
+        self.states = {}
+        self.reused_faces = 0
+
+    def state(self, face_id):
+        if face_id not in self.states:
+            self.states[face_id] = FaceState(
+                self.smoothing, self.min_cutoff, self.angle_beta, self.gaze_beta
+            )
+        return self.states[face_id]
+
+    def moved(self, frame_id, face_id, cropped_face):
+        """
+        Returns whether the face has to go through the models again.
+        """
+        state = self.state(face_id)
+        state.last_seen = frame_id
+        if self.motion_threshold <= 0:
+            return True
+        if cropped_face.size == 0:
+            return True
+        gray = cv2.cvtColor(cropped_face, cv2.COLOR_BGR2GRAY)
+        state.pending = cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        if (
+            state.face is None
+            or state.reference is None
+            or state.reused >= self.max_reuse
+        ):
+            return True
+        difference = cv2.absdiff(state.pending, state.reference).mean() / 255
+        return difference >= self.motion_threshold
+
+    def last(self, face_id):
+        """
+        Returns the last unfiltered result of the face.
+        """
+        return self.states[face_id].face
+
+    def update(self, frame_id, face, inferred):
+        """
+        Stores an inferred result as the new reference of its face and returns
+        the result with filtered angles and gaze vector.
+        """
+        state = self.state(face.face_id)
+        if inferred:
+            state.face = face
+            state.reference = state.pending
+            state.reused = 0
+        else:
+            state.reused += 1
+            self.reused_faces += 1
+        if not self.smoothing:
+            return face
+        t = frame_id / self.rate
+        return face._replace(
+            angle_list=state.angle_filter(t, face.angle_list).tolist(),
+            gaze_vector=state.gaze_filter(t, face.gaze_vector).tolist(),
+        )
+
+    def evict(self, frame_id):
+        """
+        Drops the state of the faces not seen for max_age frames.
+        """
+        for face_id in [
+            face_id
+            for face_id, state in self.states.items()
+            if frame_id - state.last_seen > self.max_age
+        ]:
+            del self.states[face_id]
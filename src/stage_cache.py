@@ -0,0 +1,193 @@
+"""
+Content-addressed on-disk cache of the per-stage results of a recording.
+Every stage keeps one entry per key, a .npy file of fixed-size records that
+is opened memory-mapped, so a re-run only pages in the frames it reads. The
+keys are hashes of everything the results depend on: the input file content
+and frame sampling, the model files and path (thus the precision), the
+runtime, the device and the stage parameters.
+    detection   boxes and face ids per frame, keyed by the face detector and
+                its thresholds; frames without faces get a face_id -1 record
+    landmarks   eye coordinates per face box
+    head_pose   yaw, pitch and roll per face box
+    gaze        gaze vector per face box, keyed by all three face models
+The downstream stages are looked up by frame and face box, so re-running with
+another prob_threshold still reuses the faces whose boxes did not change, and
+re-running with another gaze model reuses detection, landmarks and head pose.
+New records are merged into the entries on close. The least recently used
+entries are deleted once the cache directory grows beyond max_bytes.
+Sample usage:
+    cache = StageCache(cache_dir, max_bytes=1 << 30)
+    cache.open({"detection": key, "landmarks": key, ...})
+    detection = cache.detections(frame_id)
+    if detection is None:
+        cache.put_detections(frame_id, b_boxes, face_ids)
+    cache.close()
+"""
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+KEY_FIELDS = [("frame_id", "<i8"), ("face_id", "<i4"), ("b_box", "<i4", (4,))]
+STAGE_FIELDS = {
+    "detection": [],
+    "landmarks": [("left_eye_coord", "<f4", (2,)), ("right_eye_coord", "<f4", (2,))],
+    "head_pose": [("angle_list", "<f4", (3,))],
+    "gaze": [("gaze_vector", "<f4", (3,))],
+}
+
+
+def file_digest(paths):
+    """
+    Returns the sha256 of the content of the files, skipping missing ones.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_key(*parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class StageEntry:
+    def __init__(self, path, stage):
+        self.path = path
+        self.dtype = np.dtype(KEY_FIELDS + STAGE_FIELDS[stage])
+        self.records = np.zeros(0, dtype=self.dtype)
+        if os.path.exists(path):
+            try:
+                self.records = np.load(path, mmap_mode="r")
+                os.utime(path)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring the unreadable stage cache {path} ~ {e}")
+        self.new_records = []
+        self.lock = threading.Lock()
+
+    def frame_records(self, frame_id):
+        frame_ids = self.records["frame_id"]
+        start = np.searchsorted(frame_ids, frame_id, side="left")
+        end = np.searchsorted(frame_ids, frame_id, side="right")
+        return self.records[start:end]
+
+    def add(self, frame_id, face_id, b_box, values):
+        record = np.zeros((), dtype=self.dtype)
+        record["frame_id"] = frame_id
+        record["face_id"] = face_id
+        record["b_box"] = b_box
+        for name, value in values.items():
+            record[name] = value
+        with self.lock:
+            self.new_records.append(record)
+
+    def save(self):
+        """
+        Merges the new records into the entry, returns whether it was written.
+        """
+        if not self.new_records:
+            return False
+        records = np.concatenate([np.asarray(self.records), np.stack(self.new_records)])
+        records = records[np.argsort(records["frame_id"], kind="stable")]
+        self.records = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "wb") as f:
+            np.save(f, records)
+        os.replace(self.path + ".tmp", self.path)
+        return True
+
+
+class StageCache:
+    def __init__(self, cache_dir, max_bytes=512 << 20):
+        """
+        cache_dir: str, Directory of the entries.
+        max_bytes: int, Size above which the least recently used entries are
+                   deleted on close.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.hits = dict.fromkeys(STAGE_FIELDS, 0)
+        self.misses = dict.fromkeys(STAGE_FIELDS, 0)
+
+    def open(self, keys):
+        """
+        Opens the entries of the {stage: key} keys, stages without a key are
+        not cached.
+        """
+        for stage, key in keys.items():
+            path = os.path.join(self.cache_dir, f"{stage}-{key[:32]}.npy")
+            self.entries[stage] = StageEntry(path, stage)
+
+    def detections(self, frame_id):
+        """
+        Returns the cached (b_boxes, face_ids) of the frame, or None.
+        """
+        entry = self.entries.get("detection")
+        if entry is None or frame_id is None:
+            return None
+        records = entry.frame_records(frame_id)
+        if not len(records):
+            self.misses["detection"] += 1
+            return None
+        self.hits["detection"] += 1
+        records = records[records["face_id"] >= 0]
+        return np.array(records["b_box"], dtype=np.int32), records["face_id"].tolist()
+
+    def put_detections(self, frame_id, b_boxes, face_ids):
+        entry = self.entries.get("detection")
+        if entry is None or frame_id is None:
+            return
+        if not len(b_boxes):
+            entry.add(frame_id, -1, [0, 0, 0, 0], {})
+        for b_box, face_id in zip(b_boxes, face_ids):
+            entry.add(frame_id, face_id, b_box, {})
+
+    def get(self, stage, frame_id, b_box):
+        """
+        Returns the cached {field: value} of the face box in the frame, or None.
+        """
+        entry = self.entries.get(stage)
+        if entry is None or frame_id is None:
+            return None
+        for record in entry.frame_records(frame_id):
+            if np.array_equal(record["b_box"], b_box):
+                self.hits[stage] += 1
+                return {
+                    name: record[name].tolist() for name, _, _ in STAGE_FIELDS[stage]
+                }
+        self.misses[stage] += 1
+        return None
+
+    def put(self, stage, frame_id, b_box, values):
+        entry = self.entries.get(stage)
+        if entry is not None and frame_id is not None:
+            entry.add(frame_id, 0, b_box, values)
+
+    def close(self):
+        for stage, entry in self.entries.items():
+            try:
+                entry.save()
+            except OSError as e:
+                logging.warning(f"Could not write the {stage} stage cache ~ {e}")
+        self.entries = {}
+        self.evict()
+
+    def evict(self):
+        paths = sorted(
+            glob.glob(os.path.join(self.cache_dir, "*.npy")), key=os.path.getmtime
+        )
+        total = sum(os.path.getsize(path) for path in paths)
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+            logging.info(f"Evicted {os.path.basename(path)} from the stage cache")
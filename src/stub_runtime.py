@@ -0,0 +1,184 @@
+"""
+NumPy stand-in for the OpenVINO IECore, used to run and benchmark the
+pipeline on machines without the inference engine or the model files.
+Networks are recognised by the Open Model Zoo name in their path and get the
+input and output layout of the real model. The outputs are deterministic:
+one centred face, fixed eye landmarks and a head pose and gaze that follow the
+mean brightness of the input, so every stage of the pipeline has work to do.
+Inference takes a synthetic latency per model, scaled by latency_scale. The
+stub device runs one inference at a time, so infer requests queue up behind
+each other like on a single busy device, while the caller keeps running.
+Sample usage:
+    core = StubCore(latency_scale=0.5)
+    network = core.read_network(model="face-detection-adas-binary-0001.xml", weights=None)
+    net = core.load_network(network=network, device_name="CPU", num_requests=2)
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+# name: (inputs, outputs, latency_ms), shapes without the batch dimension.
+MODEL_SPECS = {
+    "face-detection": ({"data": [3, 384, 672]}, {"detection_out": [1, 200, 7]}, 15.0),
+    "landmarks-regression": ({"0": [3, 48, 48]}, {"95": [10, 1, 1]}, 0.5),
+    "head-pose-estimation": (
+        {"data": [3, 60, 60]},
+        {"angle_y_fc": [1], "angle_p_fc": [1], "angle_r_fc": [1]},
+        1.5,
+    ),
+    "gaze-estimation": (
+        {
+            "left_eye_image": [3, 60, 60],
+            "right_eye_image": [3, 60, 60],
+            "head_pose_angles": [3],
+        },
+        {"gaze_vector": [3]},
+        2.0,
+    ),
+}
+FACE_BOX = [0.35, 0.25, 0.65, 0.75]
+EYE_LANDMARKS = [0.3, 0.35, 0.7, 0.35, 0.5, 0.55, 0.35, 0.75, 0.65, 0.75]
+
+
+class StubInfo:
+    def __init__(self, shape):
+        self.shape = shape
+
+
+class StubNetwork:
+    def __init__(self, kind, batch_size=1):
+        inputs, outputs, self.latency_ms = MODEL_SPECS[kind]
+        self.kind = kind
+        self.inputs = {name: StubInfo([1] + shape) for name, shape in inputs.items()}
+        self.outputs = {name: StubInfo([1] + shape) for name, shape in outputs.items()}
+        self.layers = {}
+        self.batch_size = batch_size
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size
+        for info in list(self.inputs.values()) + list(self.outputs.values()):
+            info.shape = [batch_size] + info.shape[1:]
+
+    def infer(self, inputs, batch_size):
+        """
+        Returns the outputs of the first batch_size items of inputs. Every
+        item's outputs only depend on its own input, not on the other items
+        batched with it.
+        """
+        items = next(iter(inputs.values()))[:batch_size]
+        level = items.reshape(len(items), -1).mean(axis=1) / 255
+        outputs = {}
+        for name, info in self.outputs.items():
+            outputs[name] = np.zeros(info.shape, dtype=np.float32)
+        if self.kind == "face-detection":
+            detections = outputs["detection_out"]
+            detections[0, 0, 0] = [0, 1, 0.99] + FACE_BOX
+            detections[0, 0, 1, 0] = -1
+        elif self.kind == "landmarks-regression":
+            outputs["95"][:batch_size, :, 0, 0] = EYE_LANDMARKS
+        elif self.kind == "head-pose-estimation":
+            outputs["angle_y_fc"][:batch_size, 0] = 30 * level - 15
+            outputs["angle_p_fc"][:batch_size, 0] = 10 * level - 5
+            outputs["angle_r_fc"][:batch_size] = 0
+        else:
+            outputs["gaze_vector"][:batch_size, 0] = level - 0.5
+            outputs["gaze_vector"][:batch_size, 1] = 0.5 - level
+            outputs["gaze_vector"][:batch_size, 2] = -0.8
+        return outputs
+
+
+class StubBlob:
+    def __init__(self, shape):
+        self.buffer = np.zeros(shape, dtype=np.float32)
+
+
+class StubInferRequest:
+    def __init__(self, core, network):
+        self.core = core
+        self.network = network
+        self.input_blobs = {
+            name: StubBlob(info.shape) for name, info in network.inputs.items()
+        }
+        self.batch_size = network.batch_size
+        self.outputs = None
+        self.done_at = None
+
+    def set_batch(self, batch_size):
+        self.batch_size = batch_size
+
+    def async_infer(self):
+        latency = self.network.latency_ms / 1000 * self.core.latency_scale
+        # Larger batches cost more, but less than running the items one by one.
+        latency *= 1 + 0.5 * (self.batch_size - 1)
+        self.done_at = self.core.schedule(latency)
+        self.outputs = self.network.infer(
+            {name: blob.buffer for name, blob in self.input_blobs.items()},
+            self.batch_size,
+        )
+
+    def infer(self):
+        self.async_infer()
+        return self.wait()
+
+    def wait(self, timeout=-1):
+        if self.done_at is not None:
+            delay = self.done_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.done_at = None
+        return 0
+
+
+class StubExecutableNetwork:
+    def __init__(self, core, network, num_requests):
+        self.requests = [StubInferRequest(core, network) for _ in range(num_requests)]
+
+    def export(self, model_file):
+        raise NotImplementedError("The stub runtime has no compiled networks")
+
+
+class StubCore:
+    def __init__(self, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self.available_devices = ["CPU"]
+        self.device_free_at = 0.0
+        self.lock = threading.Lock()
+
+    def schedule(self, latency):
+        """
+        Queues an inference of the given latency on the device and returns the
+        time.perf_counter() at which it is done.
+        """
+        with self.lock:
+            start = max(time.perf_counter(), self.device_free_at)
+            self.device_free_at = start + latency
+            return self.device_free_at
+
+    def add_extension(self, extension_path, device_name):
+        pass
+
+    def set_config(self, config, device_name):
+        pass
+
+    def read_network(self, model, weights=None):
+        name = os.path.basename(model)
+        for kind in MODEL_SPECS:
+            if name.startswith(kind):
+                return StubNetwork(kind)
+        raise ValueError(f"The stub runtime does not know the model {name}")
+
+    def load_network(self, network, device_name, config=None, num_requests=1):
+        return StubExecutableNetwork(self, network, num_requests)
+
+    def import_network(self, model_file, device_name, config=None, num_requests=1):
+        raise NotImplementedError("The stub runtime has no compiled networks")
+
+    def query_network(self, network, device_name):
+        return {}
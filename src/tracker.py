@@ -0,0 +1,182 @@
+"""
+Detect-then-track face tracker.
+The face detector only has to run every detection_interval frames. In between
+every face box is propagated by matching the previous crop of the face as a
+template around its last position. A detection is requested early when a face
+is lost (its match score drops below min_confidence) or when no face is
+tracked. Faces keep their face_id across frames: detections are associated
+to the tracked faces by IoU and only unmatched detections get a new id.
+Matching runs on thumbnails: the template is the face scaled to at most
+template_width pixels wide and the search window around the face is scaled
+by the same factor, so tracking costs about the same for every face size and
+stays well below a detection. Only the search window is converted to grey.
+Sample usage:
+    tracker = FaceTracker(detection_interval=10)
+    if tracker.schedule():
+        face_ids = tracker.update(frame, detected_boxes)
+    else:
+        b_boxes, face_ids = tracker.track(frame)
+"""
+import numpy as np
+
+import cv2
+
+# Width in pixels the faces are matched at.
+TEMPLATE_WIDTH = 64
+
+
+def iou(box_a, box_b):
+    x_min = max(box_a[0], box_b[0])
+    y_min = max(box_a[1], box_b[1])
+    x_max = min(box_a[2], box_b[2])
+    y_max = min(box_a[3], box_b[3])
+    intersection = max(0, x_max - x_min) * max(0, y_max - y_min)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0
+
+
+class FaceTracker:
+    def __init__(
+        self,
+        detection_interval=10,
+        min_confidence=0.6,
+        iou_threshold=0.3,
+        search_margin=0.25,
+        template_width=TEMPLATE_WIDTH,
+    ):
+        self.detection_interval = detection_interval
+        self.min_confidence = min_confidence
+        self.iou_threshold = iou_threshold
+        self.search_margin = search_margin
+        self.template_width = template_width
+        self.face_ids = []
+        self.b_boxes = []
+        self.templates = []
+        self.next_face_id = 0
+        self.frames_since_detection = None
+        self.lost = False
+
+    def schedule(self):
+        """
+        Decides whether the next frame goes through the face detector.
+        """
+        if (
+            self.lost
+            or not self.face_ids
+            or self.frames_since_detection is None
+            or self.frames_since_detection + 1 >= self.detection_interval
+        ):
+            self.frames_since_detection = 0
+            self.lost = False
+            return True
+        self.frames_since_detection += 1
+        return False
+
+    def update(self, frame, b_boxes):
+        """
+        Replaces the tracked faces with the detected boxes and returns their ids.
+        """
+        pairs = sorted(
+            (
+                (iou(b_box, tracked_box), i, j)
+                for i, b_box in enumerate(b_boxes)
+                for j, tracked_box in enumerate(self.b_boxes)
+            ),
+            reverse=True,
+        )
+        face_ids = [None] * len(b_boxes)
+        matched = set()
+        for overlap, i, j in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if face_ids[i] is None and j not in matched:
+                face_ids[i] = self.face_ids[j]
+                matched.add(j)
+        for i, face_id in enumerate(face_ids):
+            if face_id is None:
+                face_ids[i] = self.next_face_id
+                self.next_face_id += 1
+
+        self.face_ids = face_ids
+        self.b_boxes = [list(b_box) for b_box in b_boxes]
+        self.templates = [self.template(frame, b_box) for b_box in self.b_boxes]
+        return list(self.face_ids)
+
+    def template(self, frame, b_box):
+        """
+        Returns the grey thumbnail of the face, or an empty array for an
+        empty box.
+        """
+        box_w, box_h = b_box[2] - b_box[0], b_box[3] - b_box[1]
+        if box_w <= 0 or box_h <= 0:
+            return np.empty((0, 0), dtype=np.uint8)
+        scale = min(1.0, self.template_width / box_w)
+        size = (max(1, round(box_w * scale)), max(1, round(box_h * scale)))
+        return thumbnail(frame[b_box[1] : b_box[3], b_box[0] : b_box[2]], size)
+
+    def track(self, frame):
+        """
+        Propagates the tracked boxes to the frame and returns the boxes and
+        ids of the faces that are still found.
+        """
+        height, width = frame.shape[:2]
+        face_ids, b_boxes, templates = [], [], []
+        for face_id, b_box, template in zip(
+            self.face_ids, self.b_boxes, self.templates
+        ):
+            template_h, template_w = template.shape
+            if template_h == 0 or template_w == 0:
+                self.lost = True
+                continue
+            box_w, box_h = b_box[2] - b_box[0], b_box[3] - b_box[1]
+            # Thumbnail pixels per frame pixel, per axis.
+            scale_x, scale_y = template_w / box_w, template_h / box_h
+            margin_x = int(box_w * self.search_margin)
+            margin_y = int(box_h * self.search_margin)
+            x_min = max(0, b_box[0] - margin_x)
+            y_min = max(0, b_box[1] - margin_y)
+            x_max = min(width, b_box[2] + margin_x)
+            y_max = min(height, b_box[3] + margin_y)
+            window_size = (
+                round((x_max - x_min) * scale_x),
+                round((y_max - y_min) * scale_y),
+            )
+            if window_size[0] < template_w or window_size[1] < template_h:
+                self.lost = True
+                continue
+            window = thumbnail(frame[y_min:y_max, x_min:x_max], window_size)
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, confidence, _, location = cv2.minMaxLoc(scores)
+            if not np.isfinite(confidence) or confidence < self.min_confidence:
+                self.lost = True
+                continue
+
+            # The match is in thumbnail pixels, the box keeps its frame size.
+            new_x = min(x_min + round(location[0] / scale_x), width - box_w)
+            new_y = min(y_min + round(location[1] / scale_y), height - box_h)
+            new_box = [new_x, new_y, new_x + box_w, new_y + box_h]
+            face_ids.append(face_id)
+            b_boxes.append(new_box)
+            templates.append(
+                window[
+                    location[1] : location[1] + template_h,
+                    location[0] : location[0] + template_w,
+                ].copy()
+            )
+
+        self.face_ids = face_ids
+        self.b_boxes = b_boxes
+        self.templates = templates
+        return [list(b_box) for b_box in b_boxes], list(face_ids)
+
+
+def thumbnail(image, size):
+    """
+    Returns the BGR image resized to the (width, height) size in grey.
+    """
+    if (image.shape[1], image.shape[0]) != size:
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
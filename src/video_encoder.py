@@ -0,0 +1,175 @@
+"""
+Output video encoding on its own thread.
+write() only queues the annotated frame, a background thread encodes it, so a
+slow encoder never stalls inference. The queue is bounded: when the encoder
+falls behind, new frames are dropped instead of blocking the caller. Every
+processed frame is written exactly once, at the processing rate divided by
+the interval of the frames passed to write().
+Next to the video, frames.csv lists which frame ids were written and which
+were dropped. With metadata_only no video is encoded at all and only
+frames.csv is written.
+The codec is any fourcc OpenCV supports, e.g. avc1 or mp4v for .mp4 and MJPG
+or XVID for .avi. hw_acceleration asks the FFMPEG backend for a hardware
+encoder and falls back to software encoding when none is available. A codec
+that cannot be opened falls back to mp4v or MJPG, and when that fails too no
+video is written and frames.csv marks every frame as not written.
+Frames must not be modified after they were passed to write().
+Sample usage:
+    encoder = VideoEncoder(os.path.join(output_path, "output_video"), fps, (w, h))
+    for frame_id, frame in enumerate(frames):
+        encoder.write(frame_id, frame)
+    encoder.close()
+"""
+import csv
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+from instrumentation import NULL_RECORDER
+
+AVI_CODECS = ["MJPG", "XVID", "DIVX"]
+# Codec tried when the requested one cannot be opened, per container.
+FALLBACK_CODECS = {".mp4": "mp4v", ".avi": "MJPG"}
+
+
+class VideoEncoder:
+    def __init__(
+        self,
+        path,
+        fps,
+        size,
+        codec="avc1",
+        queue_size=8,
+        metadata_only=False,
+        hw_acceleration=False,
+        recorder=NULL_RECORDER,
+        interval=1,
+    ):
+        """
+        path: str, Path of the video without extension, frames.csv goes to the
+              same directory.
+        fps: float, Frame rate of the video, i.e. processed frames per second.
+        size: tuple, (width, height) of the frames.
+        codec: str, Fourcc of the video codec.
+        queue_size: int, Number of frames waiting for the encoder before new
+                    frames are dropped.
+        metadata_only: bool, Only write frames.csv.
+        hw_acceleration: bool, Prefer a hardware encoder.
+        recorder: SpanRecorder, Receives an encode span per written frame.
+        interval: int, Processed frames per written frame, when only every
+                  nth frame is passed to write().
+        """
+        self.extension = ".avi" if codec in AVI_CODECS else ".mp4"
+        self.path = path + self.extension
+        self.metadata_path = os.path.join(os.path.dirname(path), "frames.csv")
+        self.fps = fps
+        self.size = size
+        self.codec = codec
+        self.metadata_only = metadata_only
+        self.hw_acceleration = hw_acceleration
+        self.recorder = recorder
+        self.interval = interval
+        self.queue = deque()
+        self.queue_size = max(1, queue_size)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.metadata = []
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.writer = None
+        self.thread = threading.Thread(target=self.encode, daemon=True)
+        self.thread.start()
+
+    def open_writer(self):
+        """
+        Returns an opened cv2.VideoWriter, or None if no codec could be opened.
+        """
+        fourcc = cv2.VideoWriter_fourcc(*self.codec)
+        if self.hw_acceleration and hasattr(cv2, "VIDEOWRITER_PROP_HW_ACCELERATION"):
+            writer = cv2.VideoWriter(
+                self.path,
+                cv2.CAP_FFMPEG,
+                fourcc,
+                self.fps,
+                self.size,
+                [
+                    cv2.VIDEOWRITER_PROP_HW_ACCELERATION,
+                    cv2.VIDEO_ACCELERATION_ANY,
+                ],
+            )
+            if writer.isOpened():
+                return writer
+            logging.info("No hardware video encoder available, encoding in software")
+        for codec in dict.fromkeys([self.codec, FALLBACK_CODECS[self.extension]]):
+            writer = cv2.VideoWriter(
+                self.path, cv2.VideoWriter_fourcc(*codec), self.fps, self.size, True
+            )
+            if writer.isOpened():
+                if codec != self.codec:
+                    logging.warning(f"Encoding {self.path} with {codec} instead")
+                return writer
+            logging.error(f"Could not open a {codec} video writer for {self.path}")
+        return None
+
+    def time(self, frame_id):
+        return frame_id / (self.fps * self.interval)
+
+    def write(self, frame_id, frame):
+        """
+        Queues the frame for encoding and returns whether it was accepted.
+        """
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                self.frames_dropped += 1
+                self.metadata.append((frame_id, self.time(frame_id), 0))
+                return False
+            self.queue.append((frame_id, frame))
+            self.condition.notify()
+            return True
+
+    def encode(self):
+        if not self.metadata_only:
+            self.writer = self.open_writer()
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    break
+                frame_id, frame = self.queue[0]
+            start_ns = time.perf_counter_ns()
+            if self.writer is not None:
+                self.writer.write(frame)
+            self.recorder.add(
+                frame_id, "encode", "VideoEncoder", start_ns, time.perf_counter_ns()
+            )
+            written = self.writer is not None or self.metadata_only
+            with self.condition:
+                # The frame leaves the queue only now, so frames that arrive
+                # while it is encoded count against the queue size.
+                self.queue.popleft()
+                self.frames_written += written
+                self.metadata.append((frame_id, self.time(frame_id), int(written)))
+
+    def close(self):
+        """
+        Encodes the queued frames, closes the video and writes frames.csv.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        if self.writer is not None:
+            self.writer.release()
+        with open(self.metadata_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame_id", "time", "written"])
+            writer.writerows(sorted(self.metadata))
+        if self.frames_dropped:
+            logging.info(
+                f"Video encoder dropped {self.frames_dropped} of "
+                f"{self.frames_written + self.frames_dropped} frames"
+            )